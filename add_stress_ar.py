@@ -24,21 +24,40 @@ Stress assignment rules (Watson, 2011):
 }
 
 Usage:
-python assign_stress.py input_file
-python assign_stress.py input_file --output my_path/my_filename.csv
+python add_stress_ar.py input_file
+python add_stress_ar.py input_file --output my_path/my_filename.csv
+python add_stress_ar.py input_file --workers 8
+python add_stress_ar.py input_file --stats stats.json
+python add_stress_ar.py input_file --templates 10 --check-templates
+python add_stress_ar.py input_file.parquet --outpath output.parquet --project
+python add_stress_ar.py input_file --outpath output.csv --incremental output.csv
+python add_stress_ar.py input_file --low-memory --max-memory 2G
 '''
 
 import argparse
-import pandas as pd
+import itertools
+import phone_inventory
 import re
+import stress_rules
 import sys
 
 from ast import literal_eval
+from cli_utils import (Incremental, RunStats, ShardPool, add_table_options, as_list,
+                       compact_column, map_distinct, process_table, read_chunks,
+                       rules_version, table_settings)
+from functools import lru_cache, partial
+from phone_inventory import (arabic_consonants, arabic_cv_table, arabic_glides,
+                             arabic_vowels, heavy, superheavy)
+from stress_rules import Rule, StressRules
+
+# phone classes (see phone_inventory.py)
+consonants = arabic_consonants
+vowels = arabic_vowels
+glides = arabic_glides
+
+# RunStats while --stats is on (see cli_utils.py)
+stats = None
 
-consonants = ['b','x','d','ʕ','f','ɣ','h','ħ','ʒ','k','l',
-            'm','n','q','r','s','t','θ','v','z','ð','ʃ','ʔ']
-vowels = ['a','i','u','e']
-glides = ['w','j']
 def generalize(ipa):
     '''
     Replace IPA characters with C, V, or G for consonant, vowel, glide.
@@ -46,20 +65,91 @@ def generalize(ipa):
     '''
     og = ipa
     if type(ipa) != str:
+        if stats is not None:
+            stats.count('non-string IPA')
         return ''
 
-    for char in consonants:
-        ipa = ipa.replace(char,'C')
-    for char in vowels:
-        ipa = ipa.replace(char,'V')
-    for char in glides:
-        ipa = ipa.replace(char,'G')
-    
-    ipa = ipa.replace(':','V') #long vowels
-    CV_form = ipa.replace('ˁ','') #pharyngealization diacritic
+    # one lookup per character: consonants C, vowels and long vowel
+    # marker V, glides G, pharyngealization diacritic dropped
+    CV_form = ipa.translate(arabic_cv_table)
 
     # add syllable boundaries
-    return(syllabify(CV_form))
+    return(stress_template(CV_form))
+
+
+# fewer words than this are looked up one at a time, without NumPy
+cv_array_min_words = 1000
+
+@lru_cache(maxsize=None)
+def cv_arrays():
+    '''
+    arabic_cv_table as lookup arrays over code points, for cv_skeletons().
+    Built on first use so NumPy is only imported for big batches.
+    Returns (size, lookup, keep), or None if NumPy isn't installed.
+    '''
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    cv_table_size = max(arabic_cv_table) + 1
+    cv_lookup = np.arange(cv_table_size, dtype=np.uint32)
+    cv_keep = np.ones(cv_table_size, dtype=bool)
+    for code, CV in arabic_cv_table.items():
+        if CV:
+            cv_lookup[code] = ord(CV)
+        else:
+            cv_keep[code] = False # dropped, like the pharyngealization diacritic
+    return cv_table_size, cv_lookup, cv_keep
+
+def cv_skeletons(ipa_col):
+    '''
+    Replace IPA characters with C, V, or G in every string of ipa_col at
+    once: the strings are joined one per line, decoded to an array of code
+    points and mapped through the same table as generalize() in one step
+    (under cv_array_min_words words, or without NumPy, one str.translate()
+    each). Non-strings (e.g., NaN) give ''.
+    Returns list of CV forms without syllable boundaries.
+    '''
+    ipa_col = list(ipa_col)
+    words = [ipa for ipa in ipa_col if type(ipa) == str]
+    if stats is not None:
+        stats.count('non-string IPA', len(ipa_col) - len(words))
+    if len(words) == 0:
+        return [''] * len(ipa_col)
+
+    text = '\n'.join(words)
+    arrays = None
+    if len(words) >= cv_array_min_words and text.count('\n') == len(words) - 1:
+        arrays = cv_arrays()
+    if arrays is not None:
+        import numpy as np
+        cv_table_size, cv_lookup, cv_keep = arrays
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        if codes.max() < cv_table_size:
+            mapped = cv_lookup[codes]
+            keep = cv_keep[codes]
+        else: # characters past the table are kept as they are
+            in_table = codes < cv_table_size
+            mapped = codes.copy()
+            mapped[in_table] = cv_lookup[codes[in_table]]
+            keep = np.ones(len(codes), dtype=bool)
+            keep[in_table] = cv_keep[codes[in_table]]
+        CV_forms = mapped[keep].tobytes().decode('utf-32-le').split('\n')
+    else: # few words, a word has a newline in it, or no NumPy
+        CV_forms = [ipa.translate(arabic_cv_table) for ipa in words]
+
+    if len(words) == len(ipa_col):
+        return CV_forms
+    CV_forms = iter(CV_forms)
+    return [next(CV_forms) if type(ipa) == str else '' for ipa in ipa_col]
+
+
+def generalize_batch(ipa_col):
+    '''
+    Same as generalize() for a whole column of IPA strings.
+    Returns list of syllabify() of each generalized string.
+    '''
+    return [stress_template(CV_form) for CV_form in cv_skeletons(ipa_col)]
 
 
 def syllabify(CV_form):
@@ -73,6 +163,8 @@ def syllabify(CV_form):
     try:
         nuclei = [V_ixs[0]]
     except IndexError:
+        if stats is not None:
+            stats.count('no vowel (unsyllabified)')
         return CV_form
 
     for i in range(1,len(V_ixs)):
@@ -87,8 +179,32 @@ def syllabify(CV_form):
     return(add_stress(syllabified))
 
 
-superheavy = ['VVC', 'VCC', 'VVGG']
-heavy = ['VV', 'VC', 'VG']
+def syllable_weight(syl):
+    '''
+    Weight of a CV syllable, for arabic_rules:
+    1. Light
+    2. Heavy: ends in VV, VC or VG
+    3. Superheavy: ends in VCC or VVGG
+    4. Superheavy that also ends in a heavy rhyme (VVC), so it counts as
+    heavy in the penult too
+    '''
+    if syl.endswith(superheavy):
+        return 4 if syl.endswith(heavy) else 3
+    if syl.endswith(heavy):
+        return 2
+    return 1
+
+
+# Watson's rules (see stress_rules.py), in the order add_stress() tries them
+arabic_rules = StressRules(syllable_weight, [
+    Rule('monosyllabic', position=-1, syllables=(1, 1)),
+    Rule('rule 1: final superheavy', position=-1, weights=[3, 4]),
+    Rule('rule 2: heavy penult', position=-2, weights=[2, 4]),
+    Rule('rule 3: antepenult', position=-3),
+    Rule('rule 3: disyllabic initial', position=-2), # even tho it's light
+])
+
+
 def add_stress(syllabified):
     '''
     Identify which syllable is stressed based on rules hierarchy:
@@ -98,51 +214,176 @@ def add_stress(syllabified):
     Returns form with primary stress marked.
     '''
     syllables = syllabified.split('.')
-    if len(syllables) == 1: #monosyllabic
-        return 'ˈ' + syllabified
+    index, rule_id = arabic_rules.match(arabic_rules.weights(syllables))
+    if stats is not None:
+        stats.count(arabic_rules.names[rule_id])
+    syllables[index] = 'ˈ' + syllables[index]
+    return '.'.join(syllables)
+
+
+############################### TEMPLATE INDEX ################################
+# syllabify() and add_stress() only depend on the CV form, and real words
+# collapse to a few hundred distinct CV forms (e.g., CVCCVC -> ˈCVC.CVC),
+# so each CV form is syllabified once and looked up after that.
+template_index = {}
+
+def stress_template(CV_form):
+    '''
+    Look up CV_form in template_index, adding it the first time it is seen.
+    Returns syllabify() of CV_form.
+    '''
+    try:
+        return template_index[CV_form]
+    except KeyError:
+        if stats is not None:
+            stats.count('new CV template')
+        template_index[CV_form] = syllabify(CV_form)
+        return template_index[CV_form]
+
+
+def enumerate_templates(max_length, symbols='CVG'):
+    '''
+    Add every CV form of up to max_length symbols to template_index
+    (3 ** max_length forms of the longest length, so keep it small).
+    Returns number of entries in template_index.
+    '''
+    for length in range(max_length+1):
+        for CV_form in itertools.product(symbols, repeat=length):
+            stress_template(''.join(CV_form))
+
+    return len(template_index)
+
+
+def reference_template(CV_form):
+    '''
+    Syllabified, stressed CV_form straight from Watson's rules, as string
+    tests on the syllables (without template_index or arabic_rules), for
+    check_templates(). Same output as syllabify() by another route.
+    '''
+    if 'V' not in CV_form:
+        return CV_form
+    # a syllable is the consonant before a nucleus, the nucleus, and the
+    # consonants up to the next onset
+    syllables = re.findall('[^V]V+(?:(?![^V]V)[^V])*', CV_form) or ['']
+    if len(syllables) == 1:
+        stressed = 0
+    elif syllables[-1].endswith(superheavy):
+        stressed = -1
+    elif syllables[-2].endswith(heavy):
+        stressed = -2
+    elif len(syllables) > 2:
+        stressed = -3
+    else:
+        stressed = -2
+    syllables[stressed] = 'ˈ' + syllables[stressed]
+    return '.'.join(syllables)
+
+
+def check_templates(pairs=()):
+    '''
+    Check every entry of template_index, and the (CV form, stressed form)
+    pairs given (e.g., from a run's output), against reference_template().
+    Returns list of (CV_form, form given, reference form) that differ.
+    '''
+    mismatches = []
+    for CV_form, stressed in itertools.chain(template_index.items(), pairs):
+        reference = reference_template(CV_form)
+        if stressed != reference:
+            mismatches.append((CV_form, stressed, reference))
+
+    return mismatches
+
+
+def output_templates(outpath):
+    '''
+    Returns set of the (CV form of "IPA", "CV_form") pairs in the output
+    table at outpath (missing CV forms as '').
+    '''
+    pairs = set()
+    for chunk in read_chunks(outpath, 100000, ["IPA","CV_form"], dtype=str):
+        CV_col = [CV if type(CV) == str else '' for CV in as_list(chunk["CV_form"])]
+        pairs.update(zip(cv_skeletons(as_list(chunk["IPA"])), CV_col))
+    return pairs
+
+
+def add_cv_form(df, pool, incremental=None, low_memory=False):
+    '''
+    Add column "CV_form" with the syllabified CV form with stress of
+    column "IPA", running the work over the ShardPool pool (once per
+    distinct IPA string, whole column at a time).
+    With incremental (see cli_utils.py), only rows not in the previous
+    run are generalized. With low_memory, "CV_form" is categorical.
+    Returns updated df.
+    '''
+    generalize_col = partial(map_distinct, partial(pool.map, generalize_batch))
+    if incremental is None:
+        CV_col = generalize_col(df["IPA"], categorical=low_memory)
     else:
-        final = syllables[-1]
-        penult = syllables[-2]
-        # RULE 1
-        for rime in superheavy:
-            if final.endswith(rime):
-                syllables[-1] = 'ˈ' + syllables[-1]
-                return '.'.join(syllables)
-        # RULE 2
-        for rime in heavy:
-            if penult.endswith(rime):
-                syllables[-2] = 'ˈ' + syllables[-2]
-                return '.'.join(syllables)
-        # RULE 3
-        if len(syllables) > 2:
-            syllables[-3] = 'ˈ' + syllables[-3]
-            return '.'.join(syllables)
-        else: # disyllabic, penult/initial syl stressed even tho it's light
-            syllables[-2] = 'ˈ' + syllables[-2]
-            return '.'.join(syllables)
+        CV_col = incremental.map(generalize_col, "CV_form", as_list(df["IPA"]))
+        if low_memory:
+            CV_col = compact_column(CV_col)
+
+    df["CV_form"] = CV_col
+    return df
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("input_file",  
-    help="Give path of the directory with IPA data. Must be .csv. Name of column with IPA assumed to be 'IPA'.")
+    help="Give path of the directory with IPA data. Must be .csv/.tsv (optionally compressed, e.g. .csv.gz), .parquet or .arrow. Name of column with IPA assumed to be 'IPA'.")
     parser.add_argument("--outpath", default="./output.csv",
-    help="Give output filename and path. Default is ./output.csv")
+    help="Give output filename and path; the extension gives the format, as for input_file. Default is ./output.csv")
+    parser.add_argument("--workers", type=int, default=1,
+    help="Number of worker processes. Default is 1")
+    parser.add_argument("--project", action="store_true",
+    help="Only read column 'IPA' of input_file (the other columns are left out of the output).")
+    parser.add_argument("--stats", default=None,
+    help="Give path of a .json file for per-stage timings and rule counts over distinct values (work done outside --workers only). Optional.")
+    parser.add_argument("--templates", type=int, default=None,
+    help="Pre-compute the stressed form of every CV form up to this length. Optional.")
+    parser.add_argument("--check-templates", action="store_true",
+    help="After the run, check the CV template index and the CV forms written against a separate implementation of the stress rules.")
+    add_table_options(parser)
     args = parser.parse_args()
 
-    # read in data from file as pandas df
-    df = pd.read_csv(args.input_file)
+    if args.stats is not None:
+        RunStats().instrument(sys.modules[__name__],
+            ['generalize', 'generalize_batch', 'syllabify', 'add_stress'])
+    if args.templates is not None:
+        enumerate_templates(args.templates)
+
+    incremental = None
+    if args.incremental is not None:
+        incremental = Incremental(rules_version(__file__, phone_inventory.__file__,
+                                                stress_rules.__file__),
+                                  {"CV_form": "IPA"}, args.incremental)
 
-    CV_col = []
-    for index,row in df.iterrows():
-        ipa = row["IPA"]
-        
+    columns = ["IPA"] if args.project else None
+    dtype, chunksize = table_settings(args)
+
+    with ShardPool(args.workers) as pool:
         # get CV representation with stress and syllable boundaries
-        CV_form = generalize(ipa)
-        CV_col.append(CV_form)
+        # and write to file
+        process_table(args.input_file, args.outpath,
+                      partial(add_cv_form, pool=pool, incremental=incremental,
+                              low_memory=args.low_memory),
+                      chunksize, columns=columns, dtype=dtype)
 
-    # update dataframe and write to file
-    df["CV_form"] = CV_col
+    if incremental is not None:
+        incremental.save(args.outpath)
+        print(incremental.report())
+
+    if stats is not None:
+        stats.dump(args.stats)
 
-    df.to_csv(path_or_buf=args.outpath, index=False)
+    if args.check_templates:
+        # the index of this process, and the CV forms actually written
+        # (also those stressed in --workers)
+        written = output_templates(args.outpath)
+        mismatches = check_templates(written)
+        for CV_form, stressed, reference in mismatches:
+            print(f"{CV_form}: got {stressed}, rules give {reference}")
+        if mismatches:
+            sys.exit(1)
+        print(f"CV templates: {len(template_index)} indexed and {len(written)} written, all consistent")
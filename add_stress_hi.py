@@ -11,13 +11,29 @@ Poona: Deccan College.
 Usage:
 python add_stress_hi.py input_file
 python add_stress_hi.py input_file --outpath my_path/my_filename.csv
+python add_stress_hi.py input_file --workers 8
+python add_stress_hi.py input_file --stats stats.json
+python add_stress_hi.py input_file.parquet --outpath output.parquet --project
+python add_stress_hi.py input_file --outpath output.csv --incremental output.csv
+python add_stress_hi.py input_file --low-memory --max-memory 2G
 '''
 
 import argparse
-import numpy as np
-import pandas as pd
+import phone_inventory
+import stress_rules
 import sys
 
+from cli_utils import (Incremental, RunStats, ShardPool, add_table_options, as_list,
+                       compact_column, map_distinct, process_table, rules_version,
+                       table_settings)
+from collections import Counter
+from functools import lru_cache, partial
+from phone_inventory import hindi_long, hindi_schwa, hindi_vowels
+from stress_rules import Rule, StressRules
+
+# RunStats while --stats is on (see cli_utils.py)
+stats = None
+
 
 def rewrite_pform(index,pform):
     '''
@@ -32,38 +48,79 @@ def rewrite_pform(index,pform):
     return new_pform
 
 
-vowels = ['u','ɛʱ','ɛ' 'ˈə','ɔ', 'ə̯','i','ʊ', 'õ', 'ə̃', 'ɪ̃', 'ə', 'ɪ','a','ʊ̃', 'æ', 'ᵊ']
+vowels = hindi_vowels # see phone_inventory.py
+def weight_classifier(vowels, long=hindi_long, schwa=hindi_schwa):
+    '''
+    Compile the Hindi weight system (see get_weight()) for a vowel
+    inventory. Returns function: syllable -> 1,2,3, or None if the
+    syllable has no vowel to classify it by.
+    '''
+    vowels = frozenset(vowels)
+
+    def classify(syl):
+        # long vowel
+        if long in syl:
+            if syl[-1] == long:
+                return 2 #heavy
+            else:
+                return 3 #superheavy
+        #short vowel
+        phones = syl.split(' ')
+        for ix,phone in enumerate(phones):
+            if phone[-1:] == schwa: #special case
+                return 1
+            elif phone in vowels:
+                # complex coda: superheavy, simple coda: heavy, else light
+                return {2: 3, 1: 2}.get(len(phones) - ix - 1, 1)
+        return None
+
+    return classify
+
+
+classify_weight = weight_classifier(vowels)
+weight_cache_size = 100000
+
+@lru_cache(maxsize=weight_cache_size)
 def get_weight(syl):
     '''
     Weight system of Hindi:
     1. Superheavy: C V: C and C V C C = 3
     2. Heavy: C V: and C V C = 2
     3. Light: C V = 1
-    Return 1,2,3 depending on weight of syl.
-    '''
-    # long vowel
-    if 'ː' in syl:
-        if syl[-1] == 'ː':
-            return 2 #heavy
-        else:
-            return 3 #superheavy
-    #short vowel
-    else:
-        phones = syl.split(' ')
-        for ix,phone in enumerate(phones):
-            if phone[-1] == 'ᵊ': #special case
-                return 1
-            elif phone in vowels:
-                coda = phones[ix+1:]
-                # complex coda
-                if len(coda) == 2:
-                    return 3 #superheavy
-                # simple coda
-                elif len(coda) == 1:
-                    return 2 #heavy
-                # no coda
-                else:
-                    return 1 #light
+    Return 1,2,3 depending on weight of syl, or None if it can't be
+    classified (no vowel). Cached, since syllables repeat a lot.
+    '''
+    return classify_weight(syl)
+
+
+def unclassified_syllables(pforms):
+    '''
+    Returns Counter of the syllables in pforms that get_weight()
+    can't classify.
+    '''
+    unclassified = Counter()
+    for pform in pforms:
+        for syl in pform.split('.'):
+            if get_weight(syl.strip()) is None:
+                unclassified[syl.strip()] += 1
+
+    return unclassified
+
+
+def syllable_weight(syl):
+    '''
+    get_weight() of a syllable of a pform (surrounding spaces stripped).
+    '''
+    return get_weight(syl.strip())
+
+
+# Kelkar's rules (see stress_rules.py): the heaviest syllable, or if there
+# is a tie the rightmost non-final of those tied
+hindi_rules = StressRules(syllable_weight, [
+    Rule('single heaviest syllable', heaviest=0, ties=1),
+    Rule('tie: rightmost non-final', heaviest=0, nonfinal=True),
+    Rule('tie: rightmost is final, next rightmost', heaviest=1),
+])
 
 
 def assign_stress(pform):
@@ -78,59 +135,135 @@ def assign_stress(pform):
     for syl in syls:
         syl = syl.strip()
         weight = get_weight(syl)
+        if weight is None:
+            raise ValueError(f"Can't classify the weight of syllable '{syl}' in '{pform}'")
         weights.append(weight)
-    heaviest = np.amax(weights) # get heaviest syllables
-    indices = list(np.where(weights == heaviest)[0]) # and their indices
-
-    # if there is no tie for heaviest syllable
-    if len(indices) == 1:
-        # print("stress the " + str(indices[0]))
-        new_pform = rewrite_pform(indices[0], pform)
-    # otherwise pick the rightmost, non-final
+    if stats is not None:
+        for weight in weights:
+            stats.count(f'syllable weight {weight}')
+
+    index, rule_id = hindi_rules.match(weights)
+    if stats is not None:
+        stats.count(hindi_rules.names[rule_id])
+    return rewrite_pform(index, pform)
+
+
+def assign_stress_batch(pforms):
+    '''
+    Same as assign_stress() for a list of pforms: the syllable weights of
+    all pforms go in one flat list with the offset where each pform starts,
+    and hindi_rules matches them all at once (see stress_rules.py).
+    Unlike assign_stress(), a pform with a syllable get_weight() can't
+    classify is returned unchanged (see unclassified_syllables()).
+    Returns list of updated pforms.
+    '''
+    try:
+        weights, starts = hindi_rules.weigh(pform.split('.') for pform in pforms)
+    except AttributeError:
+        # not a string; assign_stress() fails on these, so fail the same way
+        return [assign_stress(pform) for pform in pforms]
+    indices, rule_ids = hindi_rules.match_flat(weights, starts)
+
+    if stats is not None:
+        for weight, n in Counter(weights).items():
+            stats.count(f'syllable weight {weight or None}', n)
+        for rule_id, n in Counter(rule_ids).items():
+            if rule_id >= 0:
+                stats.count(hindi_rules.names[rule_id], n)
+
+    return [rewrite_pform(index, pform) if index >= 0 else pform
+            for index, pform in zip(indices, pforms)]
+
+
+def add_stress_columns(df, pool, incremental=None, low_memory=False, unstressed=None):
+    '''
+    Replace columns "pform1" and "pform2" with their stressed forms,
+    running the work over the ShardPool pool (once per distinct pform,
+    both columns in one batch). pforms with a syllable get_weight() can't
+    classify are left as they are, and counted in the Counter unstressed
+    if given. With incremental (see cli_utils.py), only rows not in the
+    previous run are stressed. With low_memory, both columns are
+    categorical.
+    Returns updated df.
+    '''
+    stress_col = partial(map_distinct, partial(pool.map, assign_stress_batch))
+    if incremental is not None:
+        new_cols = [incremental.map(stress_col, column, as_list(df[column]))
+                    for column in ["pform1","pform2"]]
+        if low_memory:
+            new_cols = [compact_column(new_col) for new_col in new_cols]
+    elif low_memory:
+        new_cols = [stress_col(df[column], categorical=True)
+                    for column in ["pform1","pform2"]]
     else:
-        #rightmost if non-final
-        if indices[-1] != (len(syls)-1):
-            # print("stress the " + str(indices[-1]))
-            new_pform = rewrite_pform(indices[-1], pform)
-        # next rightmost if rightmost is final
-        else:
-            # print("stress the " + str(indices[-2]))
-            new_pform = rewrite_pform(indices[-2], pform)
+        new_pforms = stress_col(as_list(df["pform1"]) + as_list(df["pform2"]))
+        new_cols = [new_pforms[:len(df)], new_pforms[len(df):]]
+
+    if unstressed is not None:
+        for column, new_col in zip(["pform1","pform2"], new_cols):
+            unstressed.update(pform for pform, new_pform
+                              in zip(as_list(df[column]), as_list(new_col))
+                              if pform == new_pform)
+
+    # remove old IPA forms
+    df.drop(columns=["pform1","pform2"], inplace=True)
+
+    # update dataframe with new IPA forms
+    df["pform1"], df["pform2"] = new_cols
+    return df
 
-    return new_pform
 
-        
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("input_file",  
-    help="Give path of the directory with Buckwalter data. Must be .csv. Name of column with Buckwalter assumed to be 'Buckwalter'.")
+    help="Give path of the directory with pronunciation data. Must be .csv/.tsv (optionally compressed, e.g. .csv.gz), .parquet or .arrow. Names of columns with syllabified IPA assumed to be 'pform1' and 'pform2'.")
     parser.add_argument("--outpath", default="./output.csv",
-    help="Give output filename and path. Default is ./output.csv")
+    help="Give output filename and path; the extension gives the format, as for input_file. Default is ./output.csv")
+    parser.add_argument("--workers", type=int, default=1,
+    help="Number of worker processes. Default is 1")
+    parser.add_argument("--project", action="store_true",
+    help="Only read columns 'pform1' and 'pform2' of input_file (the other columns are left out of the output).")
+    parser.add_argument("--stats", default=None,
+    help="Give path of a .json file for per-stage timings and rule counts over distinct values (work done outside --workers only). Optional.")
+    parser.add_argument("--weight-cache-size", type=int, default=weight_cache_size,
+    help=f"Number of distinct syllables to keep weights for. Default is {weight_cache_size}")
+    add_table_options(parser)
     args = parser.parse_args()
 
-    # read in data from file as pandas df
-    df = pd.read_csv(args.input_file)
+    get_weight = lru_cache(maxsize=args.weight_cache_size)(get_weight.__wrapped__)
 
-    new_pf1_col = []
-    new_pf2_col = []
+    if args.stats is not None:
+        RunStats().instrument(sys.modules[__name__],
+            ['assign_stress', 'assign_stress_batch', 'get_weight', 'rewrite_pform'])
 
-    for index,row in df.iterrows():
-        pform1 = row["pform1"]
-        pform2 = row["pform2"]
+    incremental = None
+    if args.incremental is not None:
+        incremental = Incremental(rules_version(__file__, phone_inventory.__file__,
+                                                stress_rules.__file__),
+                                  {"pform1": "pform1", "pform2": "pform2"},
+                                  args.incremental)
 
-        # assign stress to IPA forms
-        new_pform1 = assign_stress(pform1)
-        new_pform2 = assign_stress(pform2)
+    columns = ["pform1","pform2"] if args.project else None
+    dtype, chunksize = table_settings(args)
 
-        new_pf1_col.append(new_pform1)
-        new_pf2_col.append(new_pform2)
+    unstressed = Counter()
+    with ShardPool(args.workers) as pool:
+        # assign stress to IPA forms and write to file
+        process_table(args.input_file, args.outpath,
+                      partial(add_stress_columns, pool=pool, incremental=incremental,
+                              low_memory=args.low_memory, unstressed=unstressed),
+                      chunksize, columns=columns, dtype=dtype)
 
-    # remove old IPA forms
-    df.drop(columns=["pform1","pform2"], inplace=True)
-    
-    # update dataframe with new IPA forms and write to file
-    df["pform1"] = new_pf1_col
-    df["pform2"] = new_pf2_col
+    # pforms with syllables that couldn't be classified are left unstressed
+    unclassified = unclassified_syllables(unstressed)
+    if unclassified:
+        print(f"{sum(unstressed.values())} pforms left unstressed, syllables with no vowel:",
+              ', '.join(f"'{syl}' ({n})" for syl, n in unclassified.most_common(20)))
+
+    if incremental is not None:
+        incremental.save(args.outpath)
+        print(incremental.report())
 
-    df.to_csv(path_or_buf=args.outpath, index=False)
\ No newline at end of file
+    if stats is not None:
+        stats.dump(args.stats)
\ No newline at end of file
@@ -0,0 +1,393 @@
+'''
+Offline benchmarks for the transcription and stress scripts.
+
+Builds seeded synthetic corpora with Zipfian repetition (a small vocabulary
+makes up most of the tokens, like real corpora):
+* Buckwalter tokens (prefix + stem + suffix, MADAMIRA-style diacritics)
+* Arabic IPA strings (the Buckwalter vocabulary through translate())
+* Hindi syllabified pforms (space-separated phones, '.' between syllables)
+
+and measures tokens/sec and peak memory for each function (in-process,
+peak from tracemalloc) and each command-line script (in a subprocess,
+peak RSS). Results are compared with a stored baseline; the run fails if
+anything is slower or uses more memory than the baseline by more than
+the threshold.
+
+Also checks that the library modules import without pandas or NumPy and
+within import_budget_ms (each in a fresh interpreter), so small jobs and
+library use keep starting fast.
+
+Usage:
+python benchmark.py
+python benchmark.py --size 200000 --vocab 20000 --seed 1
+python benchmark.py --only translate_batch,generalize
+python benchmark.py --only imports
+python benchmark.py --save-baseline
+'''
+
+import argparse
+import csv
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from functools import partial
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+
+import add_stress_ar
+import add_stress_hi
+import transliterate
+
+
+############################## SYNTHETIC CORPORA ##############################
+bw_onsets = ['b','t','v','j','H','x','d','*','r','z','s','$','S','D','T','Z',
+             'E','g','f','q','k','l','m','n','h','w','y','>','<','}']
+bw_vowels = ['a','a','a','i','i','u','u','o']
+bw_long = ['A','iy','uw']
+bw_prefixes = ['','','','Al','wa','waAl','bi','biAl','li','lil','fa','>a']
+bw_suffixes = ['','u','i','a','N','K','F','p','pu','pi','ap','apN','iyna',
+               'uwna','At','Ati','hu','hA','humo','nA','y']
+
+hi_onsets = ['k','kʰ','g','t͡ʃ','ʤ','ʈ','ɖ','t','d','n','p','b','m','j','r',
+             'l','ʋ','s','ʃ','h']
+hi_short = ['ə','ɪ','ʊ','a','u','i','æ','ɔ']
+hi_long = ['aː','iː','uː','eː','oː']
+
+
+def zipf_sample(vocab, size, rng, exponent=1.1):
+    '''
+    Draw size tokens from vocab with Zipfian frequencies (rank ** -exponent).
+    Returns list of tokens.
+    '''
+    weights = [1 / (rank ** exponent) for rank in range(1, len(vocab)+1)]
+    return rng.choices(vocab, weights=weights, k=size)
+
+
+def buckwalter_vocab(n, rng):
+    '''
+    Return n distinct synthetic Buckwalter words.
+    '''
+    words = set()
+    while len(words) < n:
+        stem = ''
+        for i in range(rng.randint(2, 4)):
+            stem += rng.choice(bw_onsets)
+            if rng.random() < 0.2:
+                stem += '~'
+            stem += rng.choice(bw_long) if rng.random() < 0.25 else rng.choice(bw_vowels)
+        if rng.random() < 0.5:
+            stem += rng.choice(bw_onsets)
+        words.add(rng.choice(bw_prefixes) + stem + rng.choice(bw_suffixes))
+    return sorted(words)
+
+
+def hindi_vocab(n, rng):
+    '''
+    Return n distinct synthetic syllabified Hindi pforms.
+    '''
+    def syllable():
+        weight = rng.random()
+        if weight < 0.4:
+            phones = [rng.choice(hi_onsets), rng.choice(hi_short)]
+        elif weight < 0.6:
+            phones = [rng.choice(hi_onsets), rng.choice(hi_short), rng.choice(hi_onsets)]
+        elif weight < 0.85:
+            phones = [rng.choice(hi_onsets), rng.choice(hi_long)]
+        elif weight < 0.95:
+            phones = [rng.choice(hi_onsets), rng.choice(hi_long), rng.choice(hi_onsets)]
+        else:
+            phones = [rng.choice(hi_onsets), rng.choice(hi_short),
+                      rng.choice(hi_onsets), rng.choice(hi_onsets)]
+        return ' '.join(phones)
+
+    pforms = set()
+    while len(pforms) < n:
+        pforms.add(' . '.join(syllable() for i in range(rng.randint(1, 4))))
+    return sorted(pforms)
+
+
+def make_corpora(size, vocab, seed):
+    '''
+    Return dict of synthetic token lists: "buckwalter", "ipa", "hindi".
+    '''
+    rng = random.Random(seed)
+    bw_vocab = buckwalter_vocab(vocab, rng)
+    rng.shuffle(bw_vocab)
+    ipa_vocab = [ipa for ipa in transliterate.translate_batch(bw_vocab) if ipa]
+    hi_vocab = hindi_vocab(vocab, rng)
+    rng.shuffle(hi_vocab)
+
+    return {
+        "buckwalter": zipf_sample(bw_vocab, size, rng),
+        "ipa": zipf_sample(ipa_vocab, size, rng),
+        "hindi": zipf_sample(hi_vocab, size, rng),
+    }
+
+
+def write_inputs(corpora, directory):
+    '''
+    Write the corpora as input files for the command-line scripts.
+    Returns dict of file paths.
+    '''
+    paths = {name: os.path.join(directory, name + '.csv') for name in corpora}
+    columns = {"buckwalter": "Buckwalter", "ipa": "IPA", "hindi": "pform1"}
+    for name, tokens in corpora.items():
+        with open(paths[name], 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if name == "hindi":
+                writer.writerow(["word", "pform1", "pform2"])
+                for i, pform in enumerate(tokens):
+                    writer.writerow([f"w{i}", pform, tokens[-i-1]])
+            else:
+                writer.writerow(["id", columns[name]])
+                writer.writerows(enumerate(tokens))
+
+    # get_phones.py reads a fixed set of lexicons from the working directory
+    for lang in ['polish', 'hindi', 'arabic']:
+        with open(os.path.join(directory, f'lexicon_{lang}.tsv'), 'w',
+                  encoding='utf-8') as f:
+            for i, pform in enumerate(corpora["hindi"]):
+                f.write(f"w{i}\t{pform.replace(' . ', ' ')}\n")
+    for name, sep in [('phonitalia.csv', ','), ('lexique.tsv', '\t')]:
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(f"word{sep}phonological_form\n")
+            for i, ipa in enumerate(corpora["ipa"]):
+                f.write(f"w{i}{sep}{ipa}\n")
+
+    return paths
+
+
+################################# MEASUREMENT #################################
+
+def apply_each(func, tokens):
+    return [func(token) for token in tokens]
+
+
+def measure_function(batch_func, tokens, repeat):
+    '''
+    Time batch_func(tokens) (best of repeat runs), then run it once more
+    under tracemalloc. Returns (tokens per second, peak KiB).
+    '''
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        batch_func(tokens)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    batch_func(tokens)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return len(tokens) / best, peak / 1024
+
+
+# runs a script as __main__ and reports its own peak RSS on stderr: VmHWM
+# on Linux, since ru_maxrss keeps the high-water mark of the parent (the
+# benchmark process) across fork/exec
+runner = '''
+import resource, runpy, sys
+script = sys.argv[1]
+sys.argv = sys.argv[1:]
+sys.path.insert(0, sys.argv.pop(1))
+runpy.run_path(script, run_name="__main__")
+try:
+    with open("/proc/self/status") as status:
+        peak_kb = next(int(line.split()[1]) for line in status if line.startswith("VmHWM:"))
+except (OSError, StopIteration):
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print("peak_kb", peak_kb, file=sys.stderr)
+'''
+
+
+def measure_cli(args, n_tokens, cwd, repeat):
+    '''
+    Run a command-line script (best of repeat runs).
+    Returns (tokens per second, peak RSS KiB).
+    '''
+    best = float('inf')
+    peak = 0
+    script = os.path.join(here, args[0])
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', runner, script, here] + args[1:],
+                                cwd=cwd, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True, check=True)
+        best = min(best, time.perf_counter() - start)
+        peak = max(peak, int(result.stderr.split('peak_kb')[-1]))
+
+    return n_tokens / best, peak
+
+
+def run_benchmarks(corpora, only, repeat):
+    '''
+    Run every benchmark whose name is in only (or all if only is None).
+    Returns dict of name -> {"tokens_per_sec": ..., "peak_kb": ...}.
+    '''
+    functions = {
+        "translate": (partial(apply_each, transliterate.translate), "buckwalter"),
+        "translate_batch": (transliterate.translate_batch, "buckwalter"),
+        "generalize": (partial(apply_each, add_stress_ar.generalize), "ipa"),
+        "generalize_batch": (add_stress_ar.generalize_batch, "ipa"),
+        "assign_stress": (partial(apply_each, add_stress_hi.assign_stress), "hindi"),
+        "assign_stress_batch": (add_stress_hi.assign_stress_batch, "hindi"),
+    }
+    size = len(corpora["buckwalter"])
+    clis = {
+        "transliterate.py": ['transliterate.py', 'buckwalter.csv', '--outpath', 'out.csv'],
+        "add_stress_ar.py": ['add_stress_ar.py', 'ipa.csv', '--outpath', 'out.csv'],
+        "add_stress_hi.py": ['add_stress_hi.py', 'hindi.csv', '--outpath', 'out.csv'],
+        "pipeline_ar.py": ['pipeline_ar.py', 'buckwalter.csv', '--outpath', 'out.csv'],
+        "get_phones.py": ['get_phones.py'],
+    }
+    # add_stress_hi.py does pform1 and pform2, get_phones.py all five lexicons
+    cli_tokens = {"add_stress_hi.py": 2 * size, "get_phones.py": 5 * size}
+
+    results = {}
+    for name, (batch_func, corpus) in functions.items():
+        if only is None or name in only:
+            speed, peak = measure_function(batch_func, corpora[corpus], repeat)
+            results[name] = {"tokens_per_sec": speed, "peak_kb": peak}
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_inputs(corpora, directory)
+        for name, args in clis.items():
+            if only is None or name in only:
+                speed, peak = measure_cli(args, cli_tokens.get(name, size),
+                                          directory, repeat)
+                results[name] = {"tokens_per_sec": speed, "peak_kb": peak}
+
+    return results
+
+
+################################# IMPORT TIME #################################
+# most milliseconds each module may take to import, in a fresh interpreter
+import_budget_ms = {
+'phone_inventory' : 50,
+'cli_utils' : 50,
+'transliterate' : 100,
+'add_stress_ar' : 100,
+'add_stress_hi' : 100,
+'stress_rules' : 50,
+}
+# none of the modules above may import these
+heavy_modules = ['pandas', 'numpy']
+
+# imports a module and reports how long it took and what heavy modules it pulled in
+import_runner = '''
+import sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+__import__(sys.argv[2])
+print((time.perf_counter() - start) * 1000)
+print(' '.join(name for name in sys.argv[3:] if name in sys.modules))
+'''
+
+
+def check_imports(repeat):
+    '''
+    Import each module of import_budget_ms in a fresh interpreter (best
+    of repeat runs). Returns (dict of module -> milliseconds, list of
+    failure messages).
+    '''
+    times = {}
+    failures = []
+    for module, budget in import_budget_ms.items():
+        best = float('inf')
+        for i in range(repeat):
+            result = subprocess.run([sys.executable, '-c', import_runner, here, module]
+                                    + heavy_modules, capture_output=True,
+                                    text=True, check=True)
+            ms, heavy = result.stdout.split('\n')[:2]
+            best = min(best, float(ms))
+        times[module] = best
+        if best > budget:
+            failures.append(f"{module}: imports in {best:.1f} ms, budget {budget} ms")
+        if heavy:
+            failures.append(f"{module}: imports {heavy}")
+    return times, failures
+
+
+def compare(results, baseline, threshold):
+    '''
+    Compare results with baseline. Returns list of regression messages.
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if result["tokens_per_sec"] < old["tokens_per_sec"] * (1 - threshold):
+            regressions.append(f"{name}: {result['tokens_per_sec']:,.0f} tokens/sec, "
+                               f"baseline {old['tokens_per_sec']:,.0f}")
+        if result["peak_kb"] > old["peak_kb"] * (1 + threshold):
+            regressions.append(f"{name}: peak {result['peak_kb']:,.0f} KiB, "
+                               f"baseline {old['peak_kb']:,.0f}")
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100000,
+    help="Number of tokens in each synthetic corpus. Default is 100000")
+    parser.add_argument("--vocab", type=int, default=10000,
+    help="Number of distinct words in each synthetic corpus. Default is 10000")
+    parser.add_argument("--seed", type=int, default=0,
+    help="Random seed for the synthetic corpora. Default is 0")
+    parser.add_argument("--repeat", type=int, default=3,
+    help="Take the best of this many runs. Default is 3")
+    parser.add_argument("--only", default=None,
+    help="Comma-separated benchmark names to run. Default is all")
+    parser.add_argument("--baseline", default=os.path.join(here, "benchmark_baseline.json"),
+    help="Give path of the baseline .json. Default is benchmark_baseline.json next to this script")
+    parser.add_argument("--threshold", type=float, default=0.25,
+    help="Allowed slowdown/memory growth as a fraction of the baseline. Default is 0.25")
+    parser.add_argument("--save-baseline", action="store_true",
+    help="Store these results as the new baseline instead of comparing.")
+    args = parser.parse_args()
+
+    only = None if args.only is None else set(args.only.split(','))
+    corpora = make_corpora(args.size, args.vocab, args.seed)
+    results = run_benchmarks(corpora, only, args.repeat)
+
+    print(f"{'benchmark':<20}{'tokens/sec':>14}{'peak KiB':>12}")
+    for name, result in results.items():
+        print(f"{name:<20}{result['tokens_per_sec']:>14,.0f}{result['peak_kb']:>12,.0f}")
+
+    import_failures = []
+    if only is None or "imports" in only:
+        import_times, import_failures = check_imports(args.repeat)
+        print(f"{'import':<20}{'ms':>14}{'budget':>12}")
+        for module, ms in import_times.items():
+            print(f"{module:<20}{ms:>14.1f}{import_budget_ms[module]:>12}")
+        for failure in import_failures:
+            print("IMPORT", failure)
+
+    settings = {"size": args.size, "vocab": args.vocab, "seed": args.seed}
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            sys.exit(f"Baseline was recorded with {baseline['settings']}, not {settings}")
+        regressions = compare(results, baseline["results"], args.threshold)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline.")
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one.")
+    if import_failures:
+        sys.exit(1)
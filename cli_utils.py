@@ -0,0 +1,1150 @@
+'''
+Helpers shared by the command-line scripts (transliterate.py,
+add_stress_ar.py, add_stress_hi.py).
+
+ShardPool runs a per-row function over a column in several worker
+processes and puts the results back in the original row order, e.g.
+
+with ShardPool(workers=8) as pool:
+    CV_col = pool.map_unique(generalize, df["IPA"])
+
+map_unique() (and map_distinct() for batch functions) only computes each
+distinct value once, so run time scales with the vocabulary, not the rows.
+
+RunStats backs the --stats option: it times the functions of a script and
+counts the rules that fire (once per distinct value computed, not per
+row), and dumps both to a .json file.
+
+read_chunks() and TableWriter read and write tables in the format given by
+the file extension: .csv/.tsv (optionally compressed, e.g. .csv.gz),
+.parquet, or .arrow/.feather (Arrow IPC). Parquet and Arrow need pyarrow.
+Small .csv/.tsv files are read into Tables with the csv module, so short
+jobs (and library use) never import pandas or NumPy.
+
+Incremental backs the --incremental option: it copies the results of a
+previous run for rows whose input is unchanged and only computes the rest.
+
+process_table() runs chunked jobs as a pipeline: prefetch() reads the next
+chunk and WriteBehind writes the previous one in background threads while
+the current one is transformed, with bounded queues in between.
+'''
+
+import bz2
+import csv
+import gzip
+import hashlib
+import importlib.util
+import io
+import itertools
+import json
+import lzma
+import os
+import queue
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from functools import partial, wraps
+
+
+def apply_each(func, values):
+    '''
+    Apply func to every value in a shard.
+    Module-level so it can be sent to worker processes.
+    Returns list of results.
+    '''
+    return [func(value) for value in values]
+
+
+############################### TABLE FORMATS #################################
+compressions = ('.gz', '.bz2', '.xz', '.zst')
+
+# to read and write compressed .csv/.tsv without pandas
+openers = {
+'.gz' : gzip.open,
+'.bz2' : bz2.open,
+'.xz' : lzma.open,
+}
+
+# fields pd.read_csv() reads as missing by default
+na_values = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+             '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+             'n/a', 'nan', 'null'}
+
+# .csv/.tsv files smaller than this are read without pandas
+small_table_bytes = 1 << 20
+
+
+def table_format(path):
+    '''
+    Returns 'parquet', 'arrow', 'tsv' or 'csv' from the extension of path
+    (the one before any compression extension).
+    '''
+    root, ext = os.path.splitext(path)
+    if ext.lower() in compressions:
+        root, ext = os.path.splitext(root)
+    ext = ext.lower()
+    if ext in ('.parquet', '.pq'):
+        return 'parquet'
+    if ext in ('.arrow', '.feather', '.ipc'):
+        return 'arrow'
+    if ext == '.tsv':
+        return 'tsv'
+    return 'csv'
+
+
+def open_text(path, mode='r', fileobj=None):
+    '''
+    Open a (possibly .gz/.bz2/.xz compressed) text file for the csv module.
+    A UTF-8 byte order mark (e.g., from Excel) is skipped when reading.
+    With fileobj, read or write that binary file instead of opening path
+    (whose extension still gives the compression).
+    '''
+    opener = openers.get(os.path.splitext(path)[1].lower(), open)
+    encoding = 'utf-8-sig' if mode == 'r' else 'utf-8'
+    if fileobj is None:
+        return opener(path, mode + 't', encoding=encoding, newline='')
+    if opener is open:
+        return io.TextIOWrapper(fileobj, encoding=encoding, newline='')
+    return opener(fileobj, mode + 't', encoding=encoding, newline='')
+
+
+def have_pandas():
+    '''
+    Returns True if pandas can be imported.
+    '''
+    return importlib.util.find_spec('pandas') is not None
+
+
+class Table:
+    '''
+    Stand-in for a pandas DataFrame of text columns, for small files and
+    when pandas isn't installed. Supports what the CLIs do with their
+    frames: len(), .columns, df[name] (a list), df[name] = values and
+    df.drop(columns=..., inplace=True). Missing values are None.
+    '''
+
+    def __init__(self, data):
+        self.data = dict(data) # column name -> list of values
+
+    def __len__(self):
+        return len(next(iter(self.data.values()), []))
+
+    @property
+    def columns(self):
+        return list(self.data)
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def __setitem__(self, name, values):
+        self.data[name] = list(values)
+
+    def drop(self, columns, inplace=False):
+        table = self if inplace else Table(self.data)
+        for name in columns:
+            del table.data[name]
+        return None if inplace else table
+
+    def to_pandas(self):
+        import pandas as pd
+        return pd.DataFrame(self.data)
+
+
+def read_csv_tables(path, sep, header='infer', columns=None, chunksize=None):
+    '''
+    Read a .csv/.tsv with the csv module, as pd.read_csv(dtype=str) would:
+    blank lines skipped, missing fields (na_values) None.
+    Yields Tables, one per chunksize rows (or one in all, and one empty
+    Table if there are no rows, like pd.read_csv()); a callable chunksize
+    gives the rows of each next chunk.
+    '''
+    size = chunksize() if callable(chunksize) else chunksize
+    with open_text(path) as table_file:
+        reader = csv.reader(table_file, delimiter=sep)
+        rows = (row for row in reader if row)
+        if header is None:
+            names = None
+        else:
+            names = dedupe_names(next(rows, []))
+        keep = None if columns is None else [names.index(name) for name in columns]
+
+        chunk = []
+        n_chunks = 0
+        for row in rows:
+            if names is None:
+                names = list(range(len(row)))
+            if len(row) > len(names):
+                raise ValueError(f"{path}: expected {len(names)} fields, saw {len(row)}")
+            chunk.append([None if field in na_values else field for field in row]
+                         + [None] * (len(names) - len(row)))
+            if size is not None and len(chunk) == size:
+                yield csv_table(names, chunk, keep)
+                chunk = []
+                n_chunks += 1
+                size = chunksize() if callable(chunksize) else chunksize
+        if chunk or n_chunks == 0:
+            yield csv_table(names or [], chunk, keep)
+
+
+def dedupe_names(names):
+    '''
+    Returns header names as pd.read_csv() names the columns: blank ones
+    become "Unnamed: i" and repeats get a suffix (x, x.1, x.2, ...) that
+    no other column has, so no column is lost.
+    '''
+    # given names keep their name before blank ones are renamed
+    order = sorted(range(len(names)), key=lambda ix: not names[ix])
+    names = [name or f"Unnamed: {ix}" for ix, name in enumerate(names)]
+    given = set(names)
+    counts = Counter()
+    for ix in order:
+        name = count_name = names[ix]
+        count = counts[name]
+        while count > 0:
+            counts[count_name] = count + 1
+            name = f"{count_name}.{count}"
+            count = count + 1 if name in given else counts[name]
+        names[ix] = name
+        counts[name] = count + 1
+    return names
+
+
+def csv_table(names, rows, keep=None):
+    '''
+    Returns Table of rows (lists of fields) under column names names,
+    only the columns at indices keep if given.
+    '''
+    if keep is None:
+        keep = range(len(names))
+    return Table((names[i], [row[i] for row in rows]) for i in keep)
+
+
+def read_chunks(path, chunksize=None, columns=None, sep=None, header='infer',
+                dtype=None, stdlib=None):
+    '''
+    Read the table at path, only the given columns if columns isn't None.
+    Yields the whole table as one df, or chunks of chunksize rows
+    (chunksize may also be a function giving the rows of each next chunk,
+    e.g. a MemoryBudget).
+    sep and header only apply to .csv/.tsv (sep defaults to the one the
+    extension implies); Parquet and Arrow keep their stored types, except
+    that dtype='category' reads text columns as categorical from any format.
+    With stdlib (default: if pandas isn't installed, or for uncompressed
+    .csv/.tsv under small_table_bytes) the chunks are Tables of text
+    instead of dfs. A table with no rows gives one empty chunk.
+    '''
+    fmt = table_format(path)
+    if stdlib is None:
+        # the size of a compressed file says little about its rows
+        small = (fmt in ('csv', 'tsv') and not path.lower().endswith(compressions)
+                 and os.path.getsize(path) < small_table_bytes)
+        stdlib = small or not have_pandas()
+
+    if fmt in ('csv', 'tsv'):
+        if sep is None:
+            sep = '\t' if fmt == 'tsv' else ','
+        if stdlib:
+            yield from read_csv_tables(path, sep, header, columns, chunksize)
+            return
+        import pandas as pd
+        # pd.read_csv(dtype='category') holds every field as a Python
+        # string before it categorizes a column; text is far smaller
+        text_dtype = str if dtype == 'category' else dtype
+        if callable(chunksize):
+            reader = pd.read_csv(path, sep=sep, header=header, usecols=columns,
+                                 dtype=text_dtype, iterator=True)
+            data = sized_chunks(reader, chunksize)
+        else:
+            data = pd.read_csv(path, sep=sep, header=header, usecols=columns,
+                               dtype=text_dtype, chunksize=chunksize)
+        for chunk in [data] if chunksize is None else data:
+            yield chunk.astype('category') if dtype == 'category' else chunk
+        return
+
+    import pyarrow as pa
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        if chunksize is None:
+            batches = [pq.read_table(path, columns=columns)]
+        elif parquet_file.metadata.num_rows == 0:
+            table = parquet_file.schema_arrow.empty_table()
+            batches = [table if columns is None else table.select(columns)]
+        elif callable(chunksize):
+            batches = sized_batches(parquet_file.iter_batches(columns=columns), chunksize)
+        else:
+            batches = parquet_file.iter_batches(batch_size=chunksize,
+                                                columns=columns)
+    else:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        if chunksize is None or table.num_rows == 0:
+            batches = [table]
+        elif callable(chunksize):
+            batches = sized_batches(table.to_batches(), chunksize)
+        else:
+            batches = (table.slice(start, chunksize)
+                       for start in range(0, table.num_rows, chunksize))
+    for batch in batches:
+        if stdlib:
+            yield Table(batch.to_pydict())
+        else:
+            yield batch.to_pandas(strings_to_categorical=dtype == 'category')
+
+
+def sized_chunks(reader, chunksize):
+    '''
+    Yields reader.get_chunk(chunksize()) until the pd.read_csv() iterator
+    reader is done.
+    '''
+    with reader:
+        while True:
+            try:
+                yield reader.get_chunk(chunksize())
+            except StopIteration:
+                return
+
+
+def sized_batches(batches, chunksize):
+    '''
+    Regroup Arrow record batches into Tables of chunksize() rows each (the
+    last one shorter), without copying them.
+    '''
+    import pyarrow as pa
+    size = chunksize()
+    pending = []
+    n_rows = 0
+    for batch in batches:
+        while batch.num_rows > 0:
+            take = min(size - n_rows, batch.num_rows)
+            pending.append(batch.slice(0, take))
+            n_rows += take
+            batch = batch.slice(take)
+            if n_rows == size:
+                yield pa.Table.from_batches(pending)
+                pending = []
+                n_rows = 0
+                size = chunksize()
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+
+def read_table(path, columns=None, sep=None, header='infer', dtype=None,
+               stdlib=None):
+    '''
+    Returns the table at path as one df or Table (see read_chunks()).
+    '''
+    return next(read_chunks(path, None, columns, sep, header, dtype, stdlib))
+
+
+class TableWriter:
+    '''
+    Write dfs (or Tables) one after another to a single table at path, in
+    the format its extension gives (see table_format()). Compressed
+    .csv/.tsv output is inferred from the extension too (.gz, .bz2, .xz,
+    .zst). With header=False, .csv/.tsv output has no header row.
+    '''
+
+    def __init__(self, path, header=True):
+        self.path = path
+        self.format = table_format(path)
+        self.header = header
+        self.writer = None
+        self.schema = None
+        self.handle = None
+        self.first = True
+
+    def write(self, df):
+        if self.format in ('csv', 'tsv'):
+            sep = '\t' if self.format == 'tsv' else ','
+            if isinstance(df, Table) and not self.path.endswith('.zst'):
+                self.write_rows(df, sep)
+            else:
+                if isinstance(df, Table):
+                    df = df.to_pandas() # pandas writes .zst
+                df.to_csv(path_or_buf=self.path, sep=sep, index=False,
+                          header=self.header and self.first,
+                          mode='w' if self.first else 'a')
+        else:
+            import pyarrow as pa
+            if isinstance(df, Table):
+                table = pa.Table.from_pydict({str(name): values
+                                              for name, values in df.data.items()})
+            else:
+                if not all(type(column) == str for column in df.columns):
+                    df = df.rename(columns=str) # Arrow needs names
+                # categorical columns (see compact_column()) as plain text,
+                # so the output is the same with or without --low-memory
+                df = df.astype({name: df[name].cat.categories.dtype
+                                for name in df.columns if hasattr(df[name], 'cat')})
+                table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.schema = text_schema(table.schema)
+                if self.format == 'parquet':
+                    import pyarrow.parquet as pq
+                    self.writer = pq.ParquetWriter(self.path, self.schema)
+                else:
+                    self.writer = pa.ipc.new_file(self.path, self.schema)
+            # same types in every chunk
+            self.writer.write_table(table.cast(self.schema))
+        self.first = False
+
+    def write_rows(self, table, sep):
+        '''
+        Write a Table with the csv module, the way df.to_csv() would.
+        '''
+        if self.handle is None:
+            self.handle = open_text(self.path, 'w')
+            self.rows = csv.writer(self.handle, delimiter=sep, lineterminator=os.linesep)
+            if self.header:
+                self.rows.writerow(table.columns)
+        self.rows.writerows(zip(*table.data.values()))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.handle is not None:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def text_schema(schema):
+    '''
+    Returns schema with the columns Arrow typed null (no values in the
+    first chunk) as text, the type of the other text columns (or string),
+    so later chunks with values in them can be cast to it.
+    '''
+    import pyarrow as pa
+    text_type = next((field.type for field in schema
+                      if pa.types.is_string(field.type) or pa.types.is_large_string(field.type)),
+                     pa.string())
+    return pa.schema([field.with_type(text_type) if pa.types.is_null(field.type) else field
+                      for field in schema], metadata=schema.metadata)
+
+
+def write_table(df, path, header=True):
+    '''
+    Write df to path, in the format its extension gives.
+    '''
+    with TableWriter(path, header) as writer:
+        writer.write(df)
+
+
+def as_list(values):
+    '''
+    Returns a column (Series or list) as a list; Series.tolist() is much
+    faster than iterating a Series of text.
+    '''
+    return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+
+def is_missing(value):
+    '''
+    Returns True for None, NaN and pd.NA.
+    '''
+    return (value is None or (isinstance(value, float) and value != value)
+            or type(value).__name__ == 'NAType')
+
+
+def map_distinct(batch_func, values, categorical=False):
+    '''
+    Run batch_func (list of values -> list of results) once over the
+    distinct values and scatter the results back to every position.
+    Missing values (NaN/None) are passed to batch_func once, as the last
+    distinct value, so they get whatever result (or error) they got before.
+    Returns list of results in the order of values, or with categorical
+    a Categorical of them (see compact_column()); for categorical values
+    that is built from their codes, without a list per row.
+    '''
+    if categorical and hasattr(values, 'cat'):
+        return map_categories(batch_func, values)
+
+    values = as_list(values)
+    codes = {}
+    missing = []
+    for value in values:
+        if value not in codes:
+            if is_missing(value):
+                if not missing:
+                    missing.append(value)
+            else:
+                codes[value] = len(codes)
+    distinct = list(codes) + missing
+
+    results = batch_func(distinct)
+    missing_result = results[-1] if missing else None
+    results = [results[codes[value]] if value in codes else missing_result
+               for value in values]
+    return compact_column(results) if categorical else results
+
+
+############################### OVERLAPPED I/O ################################
+# chunks each of prefetch() and WriteBehind may hold, by default
+pipeline_queue_size = 2
+
+def prefetch(iterable, queue_size=pipeline_queue_size):
+    '''
+    Iterate over iterable in a background thread, at most queue_size items
+    ahead of the caller (the thread waits while the queue is full, so
+    memory stays bounded). An error in iterable is raised in the caller
+    after the items before it.
+    Yields the items of iterable in order.
+    '''
+    items = queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def put(entry):
+        # give up once the caller stopped iterating
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for item in iterable:
+                if not put(('item', item)):
+                    return
+            put(('end', None))
+        except BaseException as error:
+            put(('error', error))
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, item = items.get()
+            if kind == 'end':
+                return
+            if kind == 'error':
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class WriteBehind:
+    '''
+    Run write (one call per item) in a background thread, in the order the
+    items are put, with at most queue_size items waiting (put() waits while
+    the queue is full, so memory stays bounded). An error in write is
+    raised by the next put() or by close().
+    '''
+
+    def __init__(self, write, queue_size=pipeline_queue_size):
+        self.write = write
+        self.items = queue.Queue(queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            entry = self.items.get()
+            if entry is None:
+                return
+            if self.error is None: # after an error, only drain the queue
+                try:
+                    self.write(entry[0])
+                except BaseException as error:
+                    self.error = error
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.items.put((item,))
+
+    def close(self):
+        '''
+        Wait for the items put so far to be written.
+        '''
+        if self.thread.is_alive():
+            self.items.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def process_table(input_file, outpath, transform, chunksize=None, columns=None,
+                  sep=None, header='infer', stdlib=None, dtype=str,
+                  queue_size=pipeline_queue_size):
+    '''
+    Read input_file, apply transform (df -> df) and write the result to
+    outpath. With chunksize, stream the file that many rows at a time,
+    appending each transformed chunk to outpath. With columns, only
+    those columns of input_file are read.
+    All .csv/.tsv columns are read as text so every chunk is written the
+    same way. sep and header are as in pd.read_csv(); the output has no
+    header if the input has none (header=None). stdlib is as in
+    read_chunks(); pass False if transform needs a real DataFrame.
+    dtype='category' reads the columns as categorical instead (--low-memory).
+    chunksize may be a MemoryBudget, which sizes the chunks as it goes.
+    With chunksize, the next chunk is read and the previous one written in
+    background threads while transform runs (see prefetch() and
+    WriteBehind), up to queue_size chunks ahead/behind; queue_size=0 runs
+    the three one after another. Chunks are written in input order and
+    transform always runs in the calling thread.
+    '''
+    # row hashes of an earlier --incremental run no longer match outpath
+    if os.path.exists(row_hashes_path(outpath)):
+        os.remove(row_hashes_path(outpath))
+    with TableWriter(outpath, header=header is not None) as writer:
+        chunks = read_chunks(input_file, chunksize, columns, sep, header,
+                             dtype=dtype, stdlib=stdlib)
+        budget = chunksize if isinstance(chunksize, MemoryBudget) else None
+        if budget is not None:
+            chunks = budget.calibrate(chunks, transform, writer.write, queue_size)
+        if chunksize is None or queue_size < 1:
+            for chunk in chunks:
+                # update dataframe and write to new file
+                writer.write(transform(chunk))
+                if budget is not None:
+                    budget.check()
+            return
+
+        with WriteBehind(writer.write, queue_size) as write_behind:
+            for chunk in prefetch(chunks, queue_size):
+                write_behind.put(transform(chunk))
+                if budget is not None:
+                    budget.check()
+
+
+################################# LOW MEMORY ##################################
+# rows per chunk under --low-memory, unless given
+low_memory_chunksize = 100000
+
+def compact_column(values):
+    '''
+    Returns a list of text values as a pandas Categorical: one small
+    integer code per row over the distinct strings, instead of a string
+    per row. Without pandas, returns the list with every string interned,
+    so repeats share one object.
+    '''
+    if not have_pandas():
+        return [sys.intern(value) if type(value) == str else value
+                for value in values]
+    import pandas as pd
+    return pd.Categorical(values)
+
+
+def map_categories(batch_func, values):
+    '''
+    map_distinct() for a categorical Series: batch_func runs once over
+    its categories (and a missing value, if any), and the results are
+    returned as a Categorical indexed by the same codes.
+    '''
+    import numpy as np
+    import pandas as pd
+    distinct = values.cat.categories.tolist()
+    codes = values.cat.codes.to_numpy()
+    if (codes == -1).any():
+        distinct.append(np.nan) # passed to batch_func like map_distinct() does
+        codes = np.where(codes == -1, len(distinct) - 1, codes)
+
+    results = batch_func(distinct)
+    # the same result for several categories becomes one output category
+    result_codes, result_categories = pd.factorize(np.array(results, dtype=object))
+    return pd.Categorical.from_codes(result_codes[codes], categories=result_categories)
+
+
+def parse_size(text):
+    '''
+    Returns number of bytes in text: a number, optionally with suffix
+    K, M, G or T (powers of 1024), e.g. 512M or 1.5G.
+    '''
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    text = text.strip().upper().rstrip('B')
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def table_bytes(df):
+    '''
+    Returns the memory a df (or Table) takes, strings included.
+    '''
+    if isinstance(df, Table):
+        return sum(sys.getsizeof(value) + 8 for column in df.data.values()
+                   for value in column)
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+
+def current_rss():
+    '''
+    Returns bytes of memory this process uses now (not its peak, which
+    ru_maxrss gives and which includes the peak of the parent process):
+    from /proc/self/statm on Linux, else psutil if installed, else 0.
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    if importlib.util.find_spec('psutil') is not None:
+        import psutil
+        return psutil.Process().memory_info().rss
+    return 0
+
+
+class PeakRSS:
+    '''
+    Context manager that samples current_rss() in a background thread
+    every interval seconds while it is open; peak is the most it saw.
+    (The process' own high-water mark can't be restarted without also
+    resetting what ru_maxrss reports.)
+    '''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = current_rss()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class MemoryBudget:
+    '''
+    Chunk size that keeps process_table() within max_memory bytes (peak
+    memory of this process, not of --workers): pass it as chunksize, and
+    it is called for the rows of each next chunk.
+    process_table() runs a warm-up chunk (imports, caches) and a sample
+    chunk on their own first, and calibrate() sizes the rest from what the
+    sample took: its peak memory while it was read, transformed and
+    written, over the memory in use before it, plus the chunks the
+    pipeline queues hold, times margin (a small sample reuses memory
+    freed before it). check() halves the size (down to min_rows) whenever
+    the process is over budget between chunks.
+    '''
+
+    def __init__(self, max_memory, warmup_rows=1000, sample_rows=20000,
+                 min_rows=1000, margin=1.25):
+        self.max_memory = max_memory
+        self.warmup_rows = warmup_rows
+        self.sample_rows = sample_rows
+        self.min_rows = min_rows
+        self.margin = margin
+        self.rows = warmup_rows
+        self.over = False
+
+    def __call__(self):
+        return self.rows
+
+    def calibrate(self, chunks, transform, write, queue_size=pipeline_queue_size):
+        '''
+        Run the warm-up and sample chunks of chunks (read_chunks() with
+        self as chunksize) through transform and write, and set the size
+        of the chunks after them.
+        Returns chunks, to go on with the rest.
+        '''
+        self.rows = self.warmup_rows
+        chunk = next(chunks, None)
+        if chunk is None:
+            return chunks
+        write(transform(chunk))
+
+        self.rows = self.sample_rows
+        in_use = current_rss()
+        with PeakRSS() as rss:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return chunks
+            rows = max(len(chunk), 1)
+            input_bytes = table_bytes(chunk)
+            chunk = transform(chunk)
+            output_bytes = table_bytes(chunk)
+            write(chunk)
+            del chunk
+
+        # besides the chunk being transformed, up to queue_size + 1 are
+        # read ahead and queue_size + 1 written behind
+        row_bytes = self.margin * (max(rss.peak - in_use, 0)
+                                   + (queue_size + 1) * (input_bytes + output_bytes)) / rows
+        self.rows = max(self.min_rows,
+                        int((self.max_memory - current_rss()) / max(row_bytes, 1)))
+        return chunks
+
+    def check(self):
+        '''
+        Halve the chunk size (down to min_rows) if this process is over
+        budget; says so once if it is over even at min_rows.
+        '''
+        in_use = current_rss()
+        if in_use <= self.max_memory:
+            return
+        if self.rows <= self.min_rows and not self.over:
+            print(f"Memory budget: {in_use >> 20} MB in use is over {self.max_memory >> 20} MB "
+                  f"at {self.min_rows} rows per chunk", file=sys.stderr)
+            self.over = True
+        self.rows = max(self.min_rows, self.rows // 2)
+
+
+############################## INCREMENTAL RUNS ###############################
+def rules_version(*paths):
+    '''
+    Returns a short hash of the source files at paths (a script and the
+    modules it uses), so results are only reused by runs with exactly the
+    same rules.
+    '''
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()[:16]
+
+
+def hash_scheme():
+    '''
+    Returns name of the hash content_hashes() uses here: pandas' SipHash
+    (vectorized) if pandas is installed, else BLAKE2b.
+    '''
+    return 'siphash' if have_pandas() else 'blake2b'
+
+
+def content_hashes(values, scheme):
+    '''
+    Returns list of the 64-bit hash (int) of each text value in values,
+    0 for missing values.
+    '''
+    if scheme == 'siphash':
+        import numpy as np
+        import pandas as pd
+        hashes = pd.util.hash_array(np.array(values, dtype=object),
+                                    categorize=False).tolist()
+        return [row_hash if type(value) == str else 0
+                for value, row_hash in zip(values, hashes)]
+    blake2b = hashlib.blake2b
+    hash_of = {value: int.from_bytes(blake2b(value.encode('utf-8'), digest_size=8).digest(),
+                                     'little')
+               for value in set(values) if type(value) == str}
+    return [hash_of.get(value, 0) for value in values]
+
+
+def row_hashes_path(outpath):
+    '''
+    Returns path of the row hashes kept next to the output at outpath.
+    '''
+    return outpath + '.hashes'
+
+
+def output_fingerprint(path):
+    '''
+    Returns {'size': ..., 'sha1': ...} of the file at path, so row hashes
+    are only paired with the exact output they were saved with.
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as output_file:
+        for block in iter(lambda: output_file.read(1 << 20), b''):
+            digest.update(block)
+    return {'size': os.path.getsize(path), 'sha1': digest.hexdigest()}
+
+
+class Incremental:
+    '''
+    Reuse the results of a previous run (its output table and the row
+    hashes saved next to it) for rows whose input is unchanged.
+    columns maps each output column to the input column it's computed
+    from; a row's result is reused if its input has the same content hash
+    and the previous run had the same rules version (see rules_version()).
+    Missing inputs and results are always recomputed.
+    The hashes of this run are saved next to its output by save(), with
+    the size and SHA-1 of the output; they are ignored if the output has
+    changed since (process_table() also deletes them when it rewrites it).
+    '''
+
+    def __init__(self, rules, columns, previous=None):
+        self.rules = rules
+        self.columns = dict(columns)
+        self.scheme = hash_scheme()
+        self.hashes = {output: array('Q') for output in self.columns}
+        self.known = {output: {} for output in self.columns} # hash -> result
+        self.reused = 0
+        self.computed = 0
+        self.note = None
+        if previous is not None:
+            self.load(previous)
+
+    def header(self):
+        return {'rules': self.rules, 'columns': self.columns, 'hash': self.scheme,
+                'byteorder': sys.byteorder}
+
+    def load(self, previous):
+        '''
+        Read the results of the previous run with output previous.
+        '''
+        path = row_hashes_path(previous)
+        if not (os.path.exists(previous) and os.path.exists(path)):
+            self.note = f"No previous run at {previous}, computing every row"
+            return
+        with open(path, 'rb') as hashes_file:
+            header = json.loads(hashes_file.readline())
+            rows = header.pop('rows')
+            output = header.pop('output', None)
+            if header != self.header():
+                self.note = f"{previous} was made with other rules or hashes, computing every row"
+                return
+            if output != output_fingerprint(previous):
+                self.note = f"{previous} changed since its row hashes were saved, computing every row"
+                return
+            hashes = {}
+            for output in self.columns:
+                hashes[output] = array('Q')
+                hashes[output].fromfile(hashes_file, rows)
+
+        start = 0
+        for chunk in read_chunks(previous, 100000, list(self.columns), dtype=str):
+            end = start + len(chunk)
+            for output, known in self.known.items():
+                known.update((row_hash, result) for row_hash, result
+                             in zip(hashes[output][start:end], as_list(chunk[output]))
+                             if type(result) == str)
+            start = end
+        for known in self.known.values():
+            known.pop(0, None) # missing inputs
+
+    def map(self, batch_func, output, values):
+        '''
+        Returns list of the output column results for values (the input
+        column), running batch_func only on the values the previous run
+        has no result for.
+        '''
+        known = self.known[output]
+        hashes = content_hashes(values, self.scheme)
+        self.hashes[output].extend(hashes)
+        todo = [value for value, row_hash in zip(values, hashes)
+                if row_hash not in known]
+        self.computed += len(todo)
+        self.reused += len(hashes) - len(todo)
+
+        results = iter(batch_func(todo) if todo else [])
+        return [known[row_hash] if row_hash in known else next(results)
+                for row_hash in hashes]
+
+    def save(self, outpath):
+        '''
+        Write the row hashes of this run next to its output at outpath.
+        '''
+        header = {**self.header(), 'rows': len(next(iter(self.hashes.values()))),
+                  'output': output_fingerprint(outpath)}
+        with open(row_hashes_path(outpath), 'wb') as hashes_file:
+            hashes_file.write(json.dumps(header).encode('utf-8') + b'\n')
+            for output in self.columns:
+                self.hashes[output].tofile(hashes_file)
+
+    def report(self):
+        '''
+        Return reused/computed counts as a printable string.
+        '''
+        report = f"Incremental: {self.reused} results reused, {self.computed} computed"
+        return report if self.note is None else f"{self.note}. {report}"
+
+
+############################ COMMAND-LINE OPTIONS #############################
+def add_table_options(parser):
+    '''
+    Add the options for reading and writing tables that the scripts share
+    (--incremental, --chunksize, --low-memory, --max-memory) to parser.
+    '''
+    parser.add_argument("--incremental", default=None, metavar="PREVIOUS_OUTPUT",
+    help="Give path of the output of an earlier run (may be --outpath itself) to copy its results for unchanged rows. Optional.")
+    parser.add_argument("--chunksize", type=int, default=None,
+    help="Stream the input this many rows at a time instead of loading it all. Optional.")
+    parser.add_argument("--low-memory", action="store_true",
+    help="Keep text columns categorical (one code per row over the distinct strings) and stream the input in chunks; the output is the same.")
+    parser.add_argument("--max-memory", type=parse_size, default=None,
+    help="Give memory budget of the run (not counting --workers), e.g. 2G; the input is streamed in chunks sized to stay within it (unless --chunksize is given). Optional.")
+
+
+def table_settings(args):
+    '''
+    Returns (dtype, chunksize) for process_table() from the options
+    add_table_options() added to args.
+    --low-memory without --chunksize or --max-memory streams the input
+    low_memory_chunksize rows at a time.
+    '''
+    dtype = 'category' if args.low_memory else str
+    chunksize = args.chunksize
+    if chunksize is None and args.max_memory is not None:
+        chunksize = MemoryBudget(args.max_memory)
+    elif chunksize is None and args.low_memory:
+        chunksize = low_memory_chunksize
+    return dtype, chunksize
+
+
+class ShardPool:
+    '''
+    Split a list of values into shards, run a batch function (list of
+    values -> list of results) on each shard in a process pool, and
+    reassemble the results in the original order. With workers <= 1
+    everything runs in the calling process.
+    '''
+
+    def __init__(self, workers=1, shards_per_worker=4):
+        self.workers = workers
+        self.shards_per_worker = shards_per_worker
+        if workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+            # the workers are forked on the first task, so fork them now,
+            # before process_table() starts its I/O threads
+            self.executor.submit(int).result()
+        else:
+            self.executor = None
+
+    def map(self, batch_func, values):
+        '''
+        Run batch_func over values, one shard per task.
+        Returns list of results in the order of values.
+        '''
+        values = list(values)
+        if (self.executor is None) or (len(values) < 2):
+            return batch_func(values)
+
+        # a few shards per worker so one slow shard doesn't hold up the rest
+        n_shards = min(len(values), self.workers * self.shards_per_worker)
+        size = -(-len(values) // n_shards)
+        shards = [values[i:i+size] for i in range(0, len(values), size)]
+        results = self.executor.map(batch_func, shards)
+
+        return list(itertools.chain.from_iterable(results))
+
+    def map_each(self, func, values):
+        '''
+        Run the per-row function func over values.
+        Returns list of results in the order of values.
+        '''
+        return self.map(partial(apply_each, func), values)
+
+    def map_unique(self, func, values):
+        '''
+        Run the per-row function func once per distinct value of values.
+        Returns list of results in the order of values.
+        '''
+        return map_distinct(partial(self.map_each, func), values)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RunStats:
+    '''
+    Opt-in instrumentation for --stats: cumulative time and number of calls
+    per stage, and a counter for each rule that fires.
+
+    Scripts keep a module-level `stats = None` and only record anything
+    when it is set, so a run without --stats pays for a None check at most.
+    instrument() sets it and swaps the named functions for timed versions.
+    Only work done in the calling process is recorded (not in --workers).
+    The scripts compute each distinct value once (map_distinct() and their
+    caches), so the counters count distinct values: a word on 200 rows, or
+    200 empty rows, count once per chunk (or once per run, for values a
+    cache keeps). report() lists them under "rules (distinct values)".
+    '''
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self.last_lap = None
+
+    def timed(self, name, func):
+        '''
+        Return func wrapped to add its run time to stage name.
+        '''
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[name] += time.perf_counter() - start
+                self.calls[name] += 1
+        timed_func.stats = self
+        return timed_func
+
+    def instrument(self, module, names):
+        '''
+        Replace each function in names on module with a timed version
+        (so calls between the module's own functions are timed too),
+        and set module.stats to self.
+        '''
+        for name in names:
+            func = getattr(module, name)
+            if getattr(func, 'stats', None) is not self:
+                setattr(module, name, self.timed(name, func))
+        module.stats = self
+
+    def start(self):
+        '''
+        Start the clock for lap().
+        '''
+        self.last_lap = time.perf_counter()
+
+    def lap(self, name):
+        '''
+        Add the time since the last start() or lap() to stage name.
+        '''
+        now = time.perf_counter()
+        self.seconds[name] += now - self.last_lap
+        self.calls[name] += 1
+        self.last_lap = now
+
+    def count(self, rule, n=1):
+        '''
+        Record that rule fired n times.
+        '''
+        if n:
+            self.counters[rule] += n
+
+    def report(self):
+        '''
+        Returns dict of stage timings and rule counters.
+        '''
+        stages = {name: {"calls": self.calls[name], "seconds": self.seconds[name]}
+                  for name in sorted(self.seconds)}
+        return {"stages": stages,
+                "rules (distinct values)": dict(sorted(self.counters.items()))}
+
+    def dump(self, path):
+        '''
+        Write report() to path as .json.
+        '''
+        with open(path, 'w', encoding='utf-8') as stats_file:
+            json.dump(self.report(), stats_file, indent=2, ensure_ascii=False)
@@ -1,54 +1,310 @@
 '''
-Compiles the set of phones in a lexicon (unique) and outputs to a .txt file.
+Compiles the phones in a lexicon with how often each occurs and outputs them
+to a .txt file (one "phone<TAB>count" per line, most frequent first).
 Helpful if you want to define constraints based on segments, or group segments
 into consonants and vowels.
 
-Based on wikipron data, which has pronunciations that are space-separated,
-e.g., cat   k æ t
+Two lexicon formats:
+* wikipron: WikiPron data, which has pronunciations that are space-separated
+  in the second column of a .tsv with no header, e.g., cat   k æ t
+* chars: a .csv/.tsv with a header and a column "phonological_form" with one
+  phone per character (e.g., PhonItalia, Lexique)
+Either can also be compressed (.gz, .bz2, .xz) or the same table as .parquet
+or .arrow.
+
+Output goes to phones_{lang}.txt, where lang comes from the file name
+(lexicon_{lang}.tsv, phonitalia -> italian, lexique -> french), with the
+counts of all lexicons together in phones_all.txt.
+
+With --cache-file, the counts of each lexicon are kept between runs (by
+content hash) and a lexicon is only read again if its size or modification
+time changed.
+
+Usage:
+python get_phones.py
+python get_phones.py --wikipron lexicon_polish.tsv lexicon_hindi.tsv
+python get_phones.py --chars phonitalia.csv lexique.tsv --outdir phones/
+python get_phones.py --workers 5
+python get_phones.py --cache-file phones_cache.json
+python get_phones.py --chars lexique.parquet --ext .csv.gz
 '''
 
-import pandas as pd
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
 import sys
 
-### List of lexicons built using WikiPron
-files = ['lexicon_polish.tsv','lexicon_hindi.tsv','lexicon_arabic.tsv']
-for f in files:
-    lang = f.split('_')[1].split('.')[0]
-    print(f"Working on phone list for {lang}...")
-
-    data = pd.read_csv(f, sep='\t', index_col=False, header=None)
-    phones = set()
-    # loop over data to add phones from phonological forms to the set
-    for index,row in data.iterrows():
-        phones = set.union(phones,set(row[1].split(' ')))
-    
-    # write the set of phones to file
-    with open(f'phones_{lang}.txt','w') as phones_file:
-        phones_file.write(str(phones))
-    
-    print("Done!")
+from cli_utils import (ShardPool, Table, compressions, open_text, read_table,
+                       table_format, write_table)
+from collections import Counter
+
+### Lexicons used when none are given
+wikipron_files = ['lexicon_polish.tsv','lexicon_hindi.tsv','lexicon_arabic.tsv']
+chars_files = ['phonitalia.csv','lexique.tsv'] # not WikiPron
+
+# languages of lexicons not named lexicon_{lang}
+lexicon_langs = {
+'phonitalia' : 'italian',
+'lexique' : 'french',
+}
+
+
+def get_lang(path):
+    '''
+    Return the language of a lexicon from its file name.
+    '''
+    name = os.path.basename(path)
+    if name.endswith(compressions):
+        name = os.path.splitext(name)[0]
+    name = os.path.splitext(name)[0]
+    if name.startswith('lexicon_'):
+        return name[len('lexicon_'):]
+    return lexicon_langs.get(name, name)
+
+
+def update_hash(digest, path):
+    '''
+    Add the content of the file at path to digest.
+    '''
+    with open(path, 'rb') as lexicon_file:
+        for block in iter(lambda: lexicon_file.read(1 << 20), b''):
+            digest.update(block)
+
+
+class HashingReader(io.RawIOBase):
+    '''
+    Binary file that reads from the file raw and adds every byte it reads
+    to digest (e.g., hashlib.sha1()).
+    '''
+
+    def __init__(self, raw, digest):
+        self.raw = raw
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        self.digest.update(memoryview(buffer)[:n])
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+def count_phones(lexicon, digest=None):
+    '''
+    Stream a lexicon (path, format) line by line, counting its phones
+    (.parquet/.arrow/.zst: read just its pronunciation column).
+    With digest (e.g., hashlib.sha1()), also add the bytes of the file to
+    it, in the same read for .csv/.tsv.
+    Returns Counter of phone -> count.
+    '''
+    path, fmt = lexicon
+    phones = Counter()
+    if path.endswith('.zst') or table_format(path) in ('parquet', 'arrow'):
+        if digest is not None:
+            # the hash needs the whole file, not just the column read below
+            update_hash(digest, path)
+        # only the pronunciation column
+        if fmt == 'wikipron':
+            data = read_table(path, header=None, dtype=str)
+            pforms = data[data.columns[1]]
+        else:
+            pforms = read_table(path, columns=["phonological_form"], dtype=str)["phonological_form"]
+        for pform in pforms:
+            if type(pform) == str: # not missing
+                phones.update(pform.split(' ') if fmt == 'wikipron' else pform)
+        return phones
+
+    if digest is None:
+        raw = open(path, 'rb')
+    else:
+        raw = io.BufferedReader(HashingReader(open(path, 'rb', buffering=0), digest), 1 << 20)
+    with raw, open_text(path, fileobj=raw) as lexicon_file:
+        if fmt == 'wikipron':
+            for line in lexicon_file:
+                fields = line.rstrip('\r\n').split('\t')
+                if len(fields) > 1:
+                    phones.update(fields[1].split(' '))
+        else:
+            sep = '\t' if table_format(path) == 'tsv' else ','
+            for row in csv.DictReader(lexicon_file, delimiter=sep):
+                phones.update(row["phonological_form"] or '')
+        if digest is not None:
+            # anything the text reader stopped short of (e.g., a gzip trailer)
+            while raw.read(1 << 20):
+                pass
+
+    return phones
+
+
+def count_and_hash(lexicon):
+    '''
+    count_phones() of lexicon, hashing the file in the same read.
+    Returns (Counter of phone -> count, dict of the size, modification
+    time and sha1 hex digest of the file).
+    '''
+    stat = os.stat(lexicon[0]) # before reading, so a later change is seen
+    digest = hashlib.sha1()
+    phones = count_phones(lexicon, digest)
+    return phones, {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                    'sha1': digest.hexdigest()}
 
 
-### Italian-specific (not WikiPron)
-print("Working on phone list for italian...")
-data = pd.read_csv('phonitalia.csv', index_col=False)
-phones = set()
-# loop over data to add phones from phonological forms to the set
-for index,row in data.iterrows():
-    phones = set.union(phones,set(row["phonological_form"]))
-# write the set of phones to file
-with open('phones_italian.txt','w') as phones_file:
-    phones_file.write(str(phones))
-print("Done!")
-
-### French-specific (not WikiPron)
-print("Working on phone list for french...")
-data = pd.read_csv('lexique.tsv', sep='\t', index_col=False)
-phones = set()
-# loop over data to add phones from phonological forms to the set
-for index,row in data.iterrows():
-    phones = set.union(phones,set(row["phonological_form"]))
-# write the set of phones to file
-with open('phones_french.txt','w') as phones_file:
-    phones_file.write(str(phones))
-print("Done!")
\ No newline at end of file
+def sorted_counts(phones):
+    '''
+    Returns list of (phone, count), most frequent first
+    (ties in phone order).
+    '''
+    return sorted(phones.items(), key=lambda item: (-item[1], item[0]))
+
+
+def frequency_table(phones):
+    '''
+    Returns the phone counts as text, one "phone<TAB>count" per line,
+    most frequent first (ties in phone order) so the output is the same
+    on every run.
+    '''
+    return ''.join(f"{phone}\t{count}\n" for phone, count in sorted_counts(phones))
+
+
+class PhoneCountCache:
+    '''
+    Phone counts of lexicons from earlier runs, saved to a JSON file.
+    Counts are kept by content hash, and each lexicon (path and format)
+    has the size, modification time and hash of its file when it was
+    read, so its counts are reused while the size and modification time
+    are the same. Lexicons not looked up in a run are left out of the
+    saved file, along with counts no lexicon has any more.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {}
+        self.counts = {}
+        self.seen = set()
+        if path is not None and os.path.exists(path):
+            with open(path, encoding='utf-8') as cache_file:
+                saved = json.load(cache_file)
+            # a cache in an older layout is started over
+            self.files = saved.get('files', {})
+            self.counts = saved.get('counts', {})
+
+    @staticmethod
+    def key(lexicon):
+        path, fmt = lexicon
+        return f"{fmt}:{os.path.abspath(path)}"
+
+    def lookup(self, lexicon):
+        '''
+        Returns Counter of the cached phone counts of lexicon,
+        or None if its file changed since they were stored.
+        '''
+        key = self.key(lexicon)
+        self.seen.add(key)
+        entry = self.files.get(key)
+        if entry is None:
+            return None
+        stat = os.stat(lexicon[0])
+        if (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        phones = self.counts.get(f"{lexicon[1]}:{entry['sha1']}")
+        return None if phones is None else Counter(phones)
+
+    def store(self, lexicon, phones, entry):
+        '''
+        Store the phone counts of lexicon, with entry the size, modification
+        time and sha1 of its file (see count_and_hash()).
+        '''
+        key = self.key(lexicon)
+        self.seen.add(key)
+        self.files[key] = entry
+        self.counts[f"{lexicon[1]}:{entry['sha1']}"] = dict(phones)
+
+    def save(self):
+        '''
+        Write the cache to its file, if it has one, without the lexicons
+        not seen in this run.
+        '''
+        if self.path is None:
+            return
+        files = {key: entry for key, entry in self.files.items() if key in self.seen}
+        used = {f"{key.split(':', 1)[0]}:{entry['sha1']}" for key, entry in files.items()}
+        counts = {key: phones for key, phones in self.counts.items() if key in used}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'files': files, 'counts': counts}, cache_file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def write_phones(outdir, lang, phones, ext='.txt'):
+    '''
+    Write the phone counts of a language to phones_{lang}{ext}: the
+    frequency_table() text for .txt, else a table with columns "phone"
+    and "count" in the format the extension gives.
+    '''
+    path = os.path.join(outdir, f'phones_{lang}{ext}')
+    if ext == '.txt':
+        with open(path, 'w', encoding='utf-8') as phones_file:
+            phones_file.write(frequency_table(phones))
+    else:
+        counts = sorted_counts(phones)
+        write_table(Table({"phone": [phone for phone, count in counts],
+                           "count": [count for phone, count in counts]}), path)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wikipron", nargs='*', default=None,
+    help="Give paths of WikiPron lexicons (.tsv, space-separated phones).")
+    parser.add_argument("--chars", nargs='*', default=None,
+    help="Give paths of lexicons with one phone per character in column 'phonological_form'.")
+    parser.add_argument("--outdir", default=".",
+    help="Give directory for the phones_{lang}.txt files. Default is .")
+    parser.add_argument("--ext", default=".txt",
+    help="Give extension of the phones_{lang} files: .txt, or .csv/.tsv (optionally compressed, e.g. .csv.gz), .parquet or .arrow for a phone/count table. Default is .txt")
+    parser.add_argument("--workers", type=int, default=1,
+    help="Number of worker processes. Default is 1")
+    parser.add_argument("--cache-file", default=None,
+    help="Give path of a .json file to keep the counts of each lexicon between runs. Optional.")
+    args = parser.parse_args()
+
+    if args.wikipron is None and args.chars is None:
+        args.wikipron, args.chars = wikipron_files, chars_files
+    lexicons = ([(path, 'wikipron') for path in args.wikipron or []]
+                + [(path, 'chars') for path in args.chars or []])
+
+    # only count the lexicons that changed since the last run
+    cache = PhoneCountCache(args.cache_file)
+    counts = [cache.lookup(lexicon) for lexicon in lexicons]
+    changed = [lexicon for lexicon, phones in zip(lexicons, counts) if phones is None]
+
+    print(f"Working on phone lists for {len(changed)} of {len(lexicons)} lexicons...")
+    with ShardPool(args.workers, shards_per_worker=1) as pool:
+        new_counts = iter(pool.map_each(count_and_hash, changed))
+    for i, lexicon in enumerate(lexicons):
+        if counts[i] is None:
+            counts[i], entry = next(new_counts)
+            cache.store(lexicon, counts[i], entry)
+    cache.save()
+
+    # merge the counts of each language, and of all lexicons
+    langs = {}
+    for (path, fmt), phones in zip(lexicons, counts):
+        langs.setdefault(get_lang(path), Counter()).update(phones)
+    all_phones = sum(langs.values(), Counter())
+
+    # write the phone counts of each language to file
+    for lang, phones in langs.items():
+        write_phones(args.outdir, lang, phones, args.ext)
+        print(f"{lang}: {len(phones)} phones")
+    write_phones(args.outdir, 'all', all_phones, args.ext)
+
+    print("Done!")
@@ -0,0 +1,266 @@
+'''
+Compile an output table of the other scripts (e.g., Buckwalter -> IPA and
+CV_form from pipeline_ar.py, or word -> stressed pform1/pform2 from
+add_stress_hi.py) into a read-only binary index file, and look words up in
+it without loading the table.
+
+The index holds the words sorted (as UTF-8 bytes) in one string pool with
+an array of offsets into it, and one string pool, offset array and missing
+flags per value column. LexiconIndex opens the file with mmap, so nothing
+is parsed at startup beyond a small JSON header, a lookup is a binary
+search over the words (O(log n)), and any number of worker processes share
+one page-cache copy of the file.
+
+Usage:
+python lexicon_index.py build output.csv
+python lexicon_index.py build output.csv --key word --columns pform1 pform2 --outpath hindi.idx
+python lexicon_index.py lookup lexicon.idx kitAb qalam
+
+from lexicon_index import LexiconIndex
+with LexiconIndex('lexicon.idx') as index:
+    index.get('kitAb') # {'IPA': 'kita:b', 'CV_form': 'CV.ˈCVVC'}
+    index.lookup('kitAb', 'IPA') # 'kita:b'
+'''
+
+import argparse
+import json
+import mmap
+import struct
+import sys
+
+from array import array
+from bisect import bisect_left
+from cli_utils import is_missing, read_chunks
+
+magic = b'LEXINDEX'
+version = 1
+# magic, version, length of the JSON header that follows
+header_format = '<8sII'
+
+# key column tried in this order when none is given
+key_columns = ['Buckwalter', 'word']
+# value columns kept when none are given (those the table has)
+value_columns = ['IPA', 'CV_form', 'pform1', 'pform2']
+
+
+################################### BUILD #####################################
+def pool(strings):
+    '''
+    Returns (offsets, data): the UTF-8 strings one after another, and the
+    array of len(strings) + 1 offsets where each starts (and the last ends).
+    '''
+    offsets = array('Q', [0])
+    data = bytearray()
+    for string in strings:
+        data += string
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+
+def read_entries(input_file, key, columns, chunksize=100000):
+    '''
+    Read the key and value columns of input_file.
+    Rows with a missing key are skipped; the first row of a word wins.
+    Returns (key, columns, dict of word -> tuple of values).
+    '''
+    entries = {}
+    for chunk in read_chunks(input_file, chunksize, dtype=str):
+        if key is None:
+            key = next((name for name in key_columns if name in chunk.columns), None)
+            if key is None:
+                raise ValueError(f"{input_file} has none of the key columns {key_columns}, give --key")
+        if columns is None:
+            columns = [name for name in value_columns if name in chunk.columns]
+        for word, *values in zip(chunk[key], *(chunk[name] for name in columns)):
+            if not is_missing(word) and word not in entries:
+                entries[word] = tuple(None if is_missing(value) else value
+                                      for value in values)
+    return key, columns, entries
+
+
+def build_index(input_file, outpath, key=None, columns=None):
+    '''
+    Compile input_file (any table read_chunks() reads) into an index at
+    outpath, with key as the words (default: the first of key_columns in
+    the table) and columns as the values (default: those of value_columns
+    in the table). Returns number of words.
+    '''
+    key, columns, entries = read_entries(input_file, key, columns)
+    words = sorted(entries, key=lambda word: word.encode('utf-8'))
+
+    # (name, bytes) of each section, in file order
+    sections = []
+    offsets, data = pool(word.encode('utf-8') for word in words)
+    sections += [('key offsets', offsets.tobytes()), ('key pool', data)]
+    for ix, column in enumerate(columns):
+        values = [entries[word][ix] for word in words]
+        missing = bytes(value is None for value in values)
+        offsets, data = pool((value or '').encode('utf-8') for value in values)
+        sections += [(f'{column} missing', missing),
+                     (f'{column} offsets', offsets.tobytes()),
+                     (f'{column} pool', data)]
+
+    header = {'key': key, 'columns': columns, 'words': len(words),
+              'byteorder': sys.byteorder, 'sections': {}}
+    # the JSON header gives where each section starts; sections start at
+    # multiples of 8 so the offset arrays can be viewed in place
+    header_size = struct.calcsize(header_format)
+    while True:
+        position = header_size + len(json.dumps(header).encode('utf-8'))
+        layout = {}
+        for name, section in sections:
+            position += -position % 8
+            layout[name] = [position, len(section)]
+            position += len(section)
+        if layout == header['sections']:
+            break
+        header['sections'] = layout
+    header_json = json.dumps(header).encode('utf-8')
+
+    with open(outpath, 'wb') as index_file:
+        index_file.write(struct.pack(header_format, magic, version, len(header_json)))
+        index_file.write(header_json)
+        for name, section in sections:
+            index_file.seek(header['sections'][name][0])
+            index_file.write(section)
+
+    return len(words)
+
+
+################################### LOOKUP ####################################
+class SortedWords:
+    '''
+    The sorted words of an index as a sequence of UTF-8 bytes, for bisect.
+    '''
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, ix):
+        return self.data[self.offsets[ix]:self.offsets[ix + 1]].tobytes()
+
+
+class LexiconIndex:
+    '''
+    Read-only view of an index file made by build_index(), memory-mapped
+    so opening it costs the same for any size and worker processes share
+    its pages.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as index_file:
+            self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        header_size = struct.calcsize(header_format)
+        file_magic, file_version, json_size = struct.unpack_from(header_format, view)
+        if file_magic != magic or file_version != version:
+            raise ValueError(f"{path} is not a version {version} lexicon index")
+        header = json.loads(view[header_size:header_size + json_size].tobytes())
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was built on a {header['byteorder']}-endian machine")
+
+        self.key = header['key']
+        self.columns = header['columns']
+
+        def section(name):
+            start, length = header['sections'][name]
+            return view[start:start + length]
+
+        self.words = SortedWords(section('key offsets').cast('Q'), section('key pool'))
+        self.values = {column: (section(f'{column} missing'),
+                                section(f'{column} offsets').cast('Q'),
+                                section(f'{column} pool'))
+                       for column in self.columns}
+
+    def find(self, word):
+        '''
+        Returns position of word among the sorted words, or None if absent.
+        '''
+        target = word.encode('utf-8')
+        ix = bisect_left(self.words, target)
+        if ix < len(self.words) and self.words[ix] == target:
+            return ix
+        return None
+
+    def value(self, ix, column):
+        missing, offsets, data = self.values[column]
+        if missing[ix]:
+            return None
+        return str(data[offsets[ix]:offsets[ix + 1]], 'utf-8')
+
+    def lookup(self, word, column, default=None):
+        '''
+        Returns the column value of word (None if missing in the table),
+        or default if word isn't in the index.
+        '''
+        ix = self.find(word)
+        if ix is None:
+            return default
+        return self.value(ix, column)
+
+    def get(self, word, default=None):
+        '''
+        Returns dict of column -> value of word, or default if word isn't
+        in the index.
+        '''
+        ix = self.find(word)
+        if ix is None:
+            return default
+        return {column: self.value(ix, column) for column in self.columns}
+
+    def __getitem__(self, word):
+        entry = self.get(word)
+        if entry is None:
+            raise KeyError(word)
+        return entry
+
+    def __contains__(self, word):
+        return self.find(word) is not None
+
+    def __len__(self):
+        return len(self.words)
+
+    def close(self):
+        # release the views before the map they point into
+        self.words = self.values = None
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Compile a table into an index file.")
+    build.add_argument("input_file",
+    help="Give path of an output table of the other scripts (.csv/.tsv, optionally compressed, .parquet or .arrow).")
+    build.add_argument("--outpath", default="./lexicon.idx",
+    help="Give index filename and path. Default is ./lexicon.idx")
+    build.add_argument("--key", default=None,
+    help=f"Give name of the column with the words. Default is the first of {', '.join(key_columns)} in the table")
+    build.add_argument("--columns", nargs='*', default=None,
+    help=f"Give names of the columns to look up. Default is those of {', '.join(value_columns)} in the table")
+    lookup = subparsers.add_parser("lookup", help="Print the entries of words as JSON lines.")
+    lookup.add_argument("index_file",
+    help="Give path of an index file made with build.")
+    lookup.add_argument("words", nargs='+',
+    help="Give words to look up.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        n_words = build_index(args.input_file, args.outpath, args.key, args.columns)
+        print(f"{n_words} words indexed in {args.outpath}")
+    else:
+        with LexiconIndex(args.index_file) as index:
+            for word in args.words:
+                print(json.dumps({index.key: word, **index.get(word, {})},
+                                 ensure_ascii=False))
@@ -0,0 +1,78 @@
+'''
+Phone inventories shared by transliterate.py, add_stress_ar.py and
+add_stress_hi.py, built once at import as frozen sets (constant-time
+membership in the per-character loops) and checked by validate().
+
+Arabic phones are written the way transliterate.py outputs them: one
+character per phone, plus the pharyngealization diacritic 'ˁ' on emphatics
+(e.g. 'dˁ') and ':' for vowel length (e.g. 'a:').
+'''
+
+################################### ARABIC ####################################
+pharyngeal = 'ˁ'    # diacritic on emphatic consonants
+length = ':'        # long vowel marker
+
+arabic_consonants = frozenset([
+    'b','x','d','dˁ','ʕ','f','ɣ','h','ħ','ʒ','k','l','m','n',
+    'q','r','s','sˁ','t','tˁ','θ','v','z','ðˁ','ð','ʃ','ʔ'])
+arabic_vowels = frozenset(['a','i','u','e'])
+arabic_glides = frozenset(['w','j'])
+
+# vowels a Buckwalter segment can start with (short, long, nunation)
+arabic_vowel_initial = frozenset(['a','a:','i','i:','u','u:','e','e:',
+                                  'an','in','un'])
+# Sun letters: /ʔal-/ assimilates to these
+arabic_coronals = frozenset(['d','dˁ','n','r','s','sˁ','t','tˁ','θ','z',
+                             'ðˁ','ð','ʃ','l'])
+
+# code point -> C/V/G class of every character in Arabic IPA, as a
+# str.translate() table: long vowel marker counts as V, diacritic is dropped
+arabic_cv_table = {ord(pharyngeal): '', ord(length): 'V'}
+for phone in arabic_consonants:
+    arabic_cv_table[ord(phone[0])] = 'C'
+for phone in arabic_vowels:
+    arabic_cv_table[ord(phone)] = 'V'
+for phone in arabic_glides:
+    arabic_cv_table[ord(phone)] = 'G'
+
+# syllable rimes, as suffixes of CVG syllables (Watson, 2011)
+superheavy = ('VVC', 'VCC', 'VVGG')
+heavy = ('VV', 'VC', 'VG')
+
+################################### HINDI #####################################
+hindi_vowels = frozenset(['u','ɛʱ','ɛ','ˈə','ɔ','ə̯','i','ʊ','õ','ə̃','ɪ̃',
+                          'ə','ɪ','a','ʊ̃','æ','ᵊ'])
+hindi_long = 'ː'
+hindi_schwa = 'ᵊ'   # epenthetic schwa, always light
+
+
+def validate():
+    '''
+    Check the inventories are consistent with each other.
+    Raises ValueError naming the first problem found.
+    '''
+    classes = [arabic_consonants, arabic_vowels, arabic_glides]
+    for i, first in enumerate(classes):
+        for second in classes[i+1:]:
+            if first & second:
+                raise ValueError(f"Arabic phones in two classes: {first & second}")
+
+    for phone in arabic_consonants:
+        if not (len(phone) == 1 or (len(phone) == 2 and phone[1] == pharyngeal)):
+            raise ValueError(f"Arabic consonant is not one character: {phone!r}")
+    for phone in arabic_vowels | arabic_glides:
+        if len(phone) != 1:
+            raise ValueError(f"Arabic phone is not one character: {phone!r}")
+    if not arabic_coronals <= arabic_consonants:
+        raise ValueError(f"Sun letters that are not consonants: "
+                         f"{arabic_coronals - arabic_consonants}")
+    for phone in arabic_vowel_initial:
+        if phone[0] not in arabic_vowels:
+            raise ValueError(f"Vowel-initial segment starts with a consonant: {phone!r}")
+
+    for phone in hindi_vowels:
+        if (phone == '') or any(char in phone for char in ' .'):
+            raise ValueError(f"Hindi vowel contains a separator: {phone!r}")
+
+
+validate()
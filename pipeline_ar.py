@@ -0,0 +1,98 @@
+'''
+Buckwalter -> IPA -> syllabified, stressed CV form for Modern Standard Arabic
+in one pass.
+
+Gives the same "IPA" and "CV_form" columns as running transliterate.py and
+then add_stress_ar.py on its output, without writing the intermediate .csv
+and parsing it again: each row is transcribed, generalized and written once.
+
+Buckwalter data is expected to be one word per row, in a column "Buckwalter".
+
+Usage:
+python pipeline_ar.py input_file
+python pipeline_ar.py input_file --outpath my_path/my_filename.csv
+python pipeline_ar.py input_file --chunksize 100000 --workers 8
+python pipeline_ar.py input_file --stats stats.json
+python pipeline_ar.py input_file.parquet --outpath output.parquet --project
+python pipeline_ar.py input_file --outpath output.csv --incremental output.csv
+python pipeline_ar.py input_file --low-memory --max-memory 2G
+'''
+
+import add_stress_ar
+import argparse
+import phone_inventory
+import stress_rules
+import transliterate
+
+from cli_utils import (Incremental, RunStats, ShardPool, add_table_options,
+                       process_table, rules_version, table_settings)
+from functools import partial
+from transliterate import TranslationCache, add_ipa
+
+
+def add_ipa_and_stress(df, pool, cache, incremental=None, low_memory=False):
+    '''
+    Add column "IPA" with the transcription of column "Buckwalter", and
+    column "CV_form" with its syllabified CV form with stress.
+    With incremental (see cli_utils.py), only rows not in the previous
+    run are computed. With low_memory, both columns are categorical.
+    Returns updated df.
+    '''
+    df = add_ipa(df, pool, cache, incremental, low_memory)
+    return add_stress_ar.add_cv_form(df, pool, incremental, low_memory)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file",
+    help="Give path of the directory with Buckwalter data. Must be .csv/.tsv (optionally compressed, e.g. .csv.gz), .parquet or .arrow. Name of column with Buckwalter assumed to be 'Buckwalter'.")
+    parser.add_argument("--outpath", default="./output.csv",
+    help="Give output filename and path; the extension gives the format, as for input_file. Default is ./output.csv")
+    parser.add_argument("--cache-size", type=int, default=100000,
+    help="Number of distinct words to keep in the in-memory cache. Default is 100000")
+    parser.add_argument("--cache-file", default=None,
+    help="Give path of a .json file to keep transcriptions between runs. Optional.")
+    parser.add_argument("--workers", type=int, default=1,
+    help="Number of worker processes. Default is 1")
+    parser.add_argument("--project", action="store_true",
+    help="Only read column 'Buckwalter' of input_file (the other columns are left out of the output).")
+    parser.add_argument("--stats", default=None,
+    help="Give path of a .json file for per-stage timings and rule counts over distinct values (work done outside --workers only). Optional.")
+    add_table_options(parser)
+    args = parser.parse_args()
+
+    stats = None
+    if args.stats is not None:
+        stats = RunStats()
+        stats.instrument(transliterate,
+            ['translate', 'translate_batch', 'liaison', 'sun_letters', 'vocalize'])
+        stats.instrument(add_stress_ar,
+            ['generalize', 'generalize_batch', 'syllabify', 'add_stress'])
+
+    incremental = None
+    if args.incremental is not None:
+        incremental = Incremental(rules_version(__file__, transliterate.__file__,
+                                                add_stress_ar.__file__,
+                                                phone_inventory.__file__,
+                                                stress_rules.__file__),
+                                  {"IPA": "Buckwalter", "CV_form": "IPA"},
+                                  args.incremental)
+
+    columns = ["Buckwalter"] if args.project else None
+    dtype, chunksize = table_settings(args)
+
+    cache = TranslationCache(args.cache_size, args.cache_file)
+    with ShardPool(args.workers) as pool:
+        process_table(args.input_file, args.outpath,
+                      partial(add_ipa_and_stress, pool=pool, cache=cache,
+                              incremental=incremental, low_memory=args.low_memory),
+                      chunksize, columns=columns, dtype=dtype)
+
+    if incremental is not None:
+        incremental.save(args.outpath)
+        print(incremental.report())
+    cache.save()
+    print(cache.report())
+    if stats is not None:
+        stats.dump(args.stats)
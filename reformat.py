@@ -7,35 +7,28 @@ boundaries between unstressed.stressed syllables.
 
 Reformat Lexique to replace syllable markers with '.' and add liaison
 consonants; and spaces between phones, similar to WikiPron.
+
+Each reformatter is a subcommand working on whole columns at a time;
+with --chunksize the input is streamed that many rows at a time.
+
+Usage:
+python reformat.py phonitalia phonitalia.csv
+python reformat.py polish lexicon_polish.tsv --outpath lexicon_polish_reformat.tsv
+python reformat.py lexique lexique.tsv --chunksize 100000
+python reformat.py lexique lexique.parquet --outpath lexique_updated.parquet
 '''
 
+import argparse
+import numpy as np
 import pandas as pd
-import sys 
+import re
+import sys
 
-'''
-## PHONITALIA
-df = pd.read_csv("phonitalia.csv", index_col=False)
+from cli_utils import process_table
+from functools import partial
 
-pform_col = []
-for index,row in df.iterrows():
-    # don't mark stress on monosyllabic words
-    if len(row["PhoneSyll"]) == 1:
-        pform = row["PhoneSyll"]
-    else:
-        phones = " ".join(row["PhoneSyll"])
-        stress_ix = row["StressedSyllable"] - 1
-        syls = phones.split('.')
-        # primary stress works differently
-        if stress_ix == 0:
-            syls[stress_ix] = "ˈ" + syls[stress_ix]
-        else:
-            syls[stress_ix] = " ˈ" + syls[stress_ix][1:]
-        pform = ".".join(syl for syl in syls)
-    
-    pform_col.append(pform)
-
-df["phonological_form"] = pform_col
 
+################################# PHONITALIA ##################################
 char_dict = {
     'a\'' : 'à',
     'i\'' : 'ì',
@@ -44,61 +37,128 @@ char_dict = {
     'o\'' : 'ò'
 }
 
-word_col = []
-lemma_col = []
-for index,row in df.iterrows():
-    word = row["word"]
-    lemma = row["lemma"]
-    for grapheme in char_dict.keys():
-        if grapheme in word:
-            word = word.replace(grapheme, char_dict[grapheme])
-        if grapheme in lemma:
-            lemma = lemma.replace(grapheme, char_dict[grapheme])
-    word_col.append(ortho)
-    lemma_col.append(lemma)
-
-df["word"] = word_col
-df["lemma"] = lemma_col
-
-df.to_csv(path_or_buf="phonitalia_reformat.csv", index=False)
-'''
-
-'''
-## POLISH WIKIPRON
-df = pd.read_csv("lexicon_polish.tsv", sep='\t', index_col=False)
-
-for index,row in df.iterrows():
-    pform = row[1].replace('ˈ','. ˈ').strip('.')
-    pform = pform.replace('/','').strip(' ')
-    row[1] = pform
-
-df.to_csv(path_or_buf="lexicon_polish.csv", index=False)
-'''
-
-'''
-## LEXIQUE
-df = pd.read_csv("lexique.tsv", sep='\t', index_col=False)
-
-pform_col = []
-for index,row in df.iterrows():
+def phonitalia_pform(phone_syll, stressed_syllable):
+    '''
+    Space-separate the phones of one PhonItalia form and mark stress on
+    its stressed syllable (numbered from 1).
+    Returns updated form.
+    '''
+    # don't mark stress on monosyllabic words
+    if len(phone_syll) == 1:
+        return phone_syll
+    phones = " ".join(phone_syll)
+    stress_ix = stressed_syllable - 1
+    syls = phones.split('.')
+    # primary stress works differently
+    if stress_ix == 0:
+        syls[stress_ix] = "ˈ" + syls[stress_ix]
+    else:
+        syls[stress_ix] = " ˈ" + syls[stress_ix][1:]
+    return ".".join(syl for syl in syls)
+
+
+def reformat_phonitalia(df):
+    '''
+    Add column "phonological_form" with the stress-marked, space-separated
+    "PhoneSyll" of each row, and replace apostrophe accents in "word" and
+    "lemma" with accented graphemes.
+    Returns updated df.
+    '''
+    phone_syll = df["PhoneSyll"]
+    stress_ix = pd.to_numeric(df["StressedSyllable"], errors='coerce') - 1
+    n_syls = phone_syll.str.count(r'\.') + 1
+
+    phones = phone_syll.str.join(" ")
+    pform = pd.Series(np.nan, index=df.index, dtype=object)
+    # don't mark stress on monosyllabic words
+    single = phone_syll.str.len() == 1
+    pform[single] = phone_syll[single]
+    # primary stress works differently
+    first = ~single & (stress_ix == 0)
+    pform[first] = "ˈ" + phones[first]
+    # later syllables: stress goes after the space following the boundary
+    later = ~single & (stress_ix > 0) & (stress_ix < n_syls)
+    for ix in stress_ix[later].unique():
+        rows = later & (stress_ix == ix)
+        boundary = re.compile(r'^((?:[^.]*\.){%d}) ?' % ix)
+        pform[rows] = phones[rows].str.replace(boundary, r'\1 ˈ', n=1, regex=True)
+
+    # anything else (missing or out-of-range stress) as phonitalia_pform() does it
+    other = ~(single | first | later)
+    pform[other] = [phonitalia_pform(syll, ix + 1)
+                    for syll, ix in zip(phone_syll[other], stress_ix[other])]
+    df["phonological_form"] = pform
+
+    for column in ["word", "lemma"]:
+        for grapheme in char_dict.keys():
+            df[column] = df[column].str.replace(grapheme, char_dict[grapheme],
+                                                regex=False)
+
+    return df
+
+
+############################### POLISH WIKIPRON ###############################
+def reformat_polish(df):
+    '''
+    Add the syllable boundary before every stressed syllable and remove
+    stray '/' from the pronunciations (second column, no header).
+    Returns updated df.
+    '''
+    pron = df.columns[1]
+    pform = df[pron].str.replace('ˈ', '. ˈ', regex=False).str.strip('.')
+    df[pron] = pform.str.replace('/', '', regex=False).str.strip(' ')
+
+    return df
+
+
+################################### LEXIQUE ###################################
+def reformat_lexique(df):
+    '''
+    Add column "phonological_form" with the "syll" form of each row:
+    syllable marker "-" replaced with ".", liaison consonant marked with a
+    final "T", and phones space-separated like WikiPron.
+    Returns updated df.
+    '''
     # replace syllable marker "-" with "."
-    phones = row["syll"]
-    phones = phones.replace("-",".")
-
-    # get CV representations of liaison form and regular form
-    liaison_cv = row["cvcv"]
-    regular_cv = row["p_cvcv"]
+    phones = df["syll"].str.replace("-", ".", regex=False)
 
-    # if there is a liaison consonant, add "T" to the end of the word
-    if regular_cv[-1] == "V":
-        if liaison_cv[-1] == "C":
-            phones += 'T'
+    # if there is a liaison consonant (CV representation of the regular
+    # form ends in V, of the liaison form in C), add "T" to the end
+    liaison = (df["p_cvcv"].str[-1] == "V") & (df["cvcv"].str[-1] == "C")
+    phones[liaison] = phones[liaison] + 'T'
 
     # space-separate phones just like WikiPron
-    pform = " ".join(phones)
-
-    pform_col.append(pform)
+    df["phonological_form"] = phones.str.join(" ")
+
+    return df
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="lexicon", required=True)
+    defaults = {
+        "phonitalia": ("./phonitalia_reformat.csv", "PhonItalia .csv"),
+        "polish": ("./lexicon_polish_reformat.tsv", "Polish WikiPron .tsv"),
+        "lexique": ("./lexique_updated.csv", "Lexique .tsv"),
+    }
+    for lexicon, (outpath, description) in defaults.items():
+        subparser = subparsers.add_parser(lexicon, help=f"Reformat {description}.")
+        subparser.add_argument("input_file",
+        help=f"Give path of the {description} (or the same table as .parquet/.arrow, or compressed, e.g. .gz).")
+        subparser.add_argument("--outpath", default=outpath,
+        help=f"Give output filename and path; the extension gives the format (.csv/.tsv, optionally compressed, .parquet, .arrow). Default is {outpath}")
+        subparser.add_argument("--chunksize", type=int, default=None,
+        help="Stream the input this many rows at a time instead of loading it all. Optional.")
+    args = parser.parse_args()
+
+    if args.lexicon == "phonitalia":
+        reformat = partial(process_table, transform=reformat_phonitalia)
+    elif args.lexicon == "polish":
+        # WikiPron has no header
+        reformat = partial(process_table, transform=reformat_polish, header=None)
+    else:
+        reformat = partial(process_table, transform=reformat_lexique)
 
-df["phonological_form"] = pform_col
-df.to_csv(path_or_buf="lexique_updated.csv",index=False)
-'''
\ No newline at end of file
+    # the reformatters use pandas string methods, so no stdlib Tables
+    reformat(args.input_file, args.outpath, chunksize=args.chunksize, stdlib=False)
@@ -0,0 +1,245 @@
+'''
+Long-lived server for the Arabic and Hindi scripts, for callers that send a
+few words at a time and shouldn't pay for Python startup on every call.
+
+Protocol: newline-delimited JSON over stdin/stdout and/or a local (Unix)
+socket. One request per line, e.g.
+{"id": 1, "op": "translate", "words": ["kitAb", "qalam"]}
+and one response line per request, in the order the requests came in:
+{"id": 1, "results": ["kita:b", "qalam"], "latency_ms": 0.09}
+or {"id": 1, "error": "..."} if the request can't be run.
+
+ops:
+* translate: Buckwalter -> IPA (transliterate.py, compiled engine)
+* generalize: IPA -> syllabified, stressed CV form (add_stress_ar.py)
+* assign_stress: syllabified pform -> pform with stress (add_stress_hi.py),
+  or null for a pform with a syllable whose weight can't be classified
+
+Requests that come in while a batch is running are collected into the next
+batch, and all words for the same op in a batch are run in one call.
+latency_ms is the time from reading a request to writing its response.
+
+The server stops on Ctrl-C or SIGTERM, finishing the requests it has and
+removing its socket.
+
+Usage:
+python server.py
+python server.py --socket /tmp/language-scripts.sock
+python server.py --socket /tmp/language-scripts.sock --no-stdio
+'''
+
+import argparse
+import json
+import os
+import queue
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+
+from add_stress_ar import generalize_batch
+from add_stress_hi import assign_stress_batch
+from collections import deque
+from transliterate import TranslationCache
+
+
+class MicroBatcher:
+    '''
+    Runs requests from any number of connections on one worker thread.
+    Whatever has been submitted while a batch runs goes into the next
+    batch (up to max_batch requests), so a lone request never waits for
+    others to arrive.
+    '''
+
+    def __init__(self, ops, max_batch=1024):
+        self.ops = ops
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.latencies = deque(maxlen=100000)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, line, reply):
+        '''
+        Queue a request line; reply(response) is called with its response.
+        '''
+        self.queue.put((time.perf_counter(), line, reply))
+
+    def stop(self):
+        '''
+        Finish the requests already submitted, then stop.
+        '''
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                self.run_batch(batch)
+            if stop:
+                return
+
+    def run_batch(self, batch):
+        '''
+        Run every request in batch, one call per op, and send the responses.
+        '''
+        requests = []
+        for received, line, reply in batch:
+            response = {}
+            try:
+                request = json.loads(line)
+                response["id"] = request.get("id")
+                op, words = request["op"], request["words"]
+                if op not in self.ops:
+                    raise ValueError(f"unknown op '{op}'")
+                if type(words) != list:
+                    raise TypeError("words must be a list")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                response["error"] = f"{type(e).__name__}: {e}"
+                op, words = None, []
+            requests.append((received, reply, response, op, words))
+
+        # all the words for an op in one call
+        for op in {op for _, _, _, op, _ in requests if op is not None}:
+            group = [request for request in requests if request[3] == op]
+            words = [word for request in group for word in request[4]]
+            try:
+                results = iter(self.ops[op](words))
+                for _, _, response, _, op_words in group:
+                    response["results"] = [next(results) for word in op_words]
+            except Exception:
+                # one bad request shouldn't fail the rest of the batch
+                for _, _, response, _, op_words in group:
+                    try:
+                        response["results"] = list(self.ops[op](op_words))
+                    except Exception as e:
+                        response["error"] = f"{type(e).__name__}: {e}"
+
+        for received, reply, response, op, words in requests:
+            response["latency_ms"] = round((time.perf_counter() - received) * 1000, 3)
+            self.latencies.append(response["latency_ms"])
+            reply(json.dumps(response, ensure_ascii=False) + '\n')
+
+    def report(self):
+        '''
+        Return latency percentiles of the requests so far as a printable string.
+        '''
+        if not self.latencies:
+            return "No requests"
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return f"{len(latencies)} requests, p50 {p50} ms, p99 {p99} ms"
+
+
+def assign_stress_or_none(pforms):
+    '''
+    assign_stress_batch(), with None (null) for the pforms it leaves
+    unchanged because a syllable's weight can't be classified.
+    Returns list of updated pforms.
+    '''
+    return [None if new_pform == pform else new_pform
+            for pform, new_pform in zip(pforms, assign_stress_batch(pforms))]
+
+
+def make_ops(cache):
+    '''
+    Returns dict of op name -> batch function (list of words -> list of results).
+    '''
+    return {
+        "translate": cache.translate,
+        "generalize": generalize_batch,
+        "assign_stress": assign_stress_or_none,
+    }
+
+
+def line_writer(stream):
+    '''
+    Returns reply function writing response lines to stream, one at a time.
+    '''
+    lock = threading.Lock()
+
+    def reply(text):
+        with lock:
+            try:
+                stream.write(text)
+                stream.flush()
+            except (OSError, ValueError): # the client went away
+                pass
+
+    return reply
+
+
+def serve_socket(path, batcher):
+    '''
+    Serve requests on a Unix socket at path, one thread per connection.
+    Returns the server (already running in a background thread).
+    '''
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            reply = line_writer(self.wfile)
+            for line in self.rfile:
+                if line.strip():
+                    batcher.submit(line, lambda text: reply(text.encode('utf-8')))
+
+    # only replace a socket left behind by an earlier server
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise FileExistsError(f"{path} exists and is not a socket")
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=None,
+    help="Give path of a Unix socket to serve requests on. Optional.")
+    parser.add_argument("--no-stdio", action="store_true",
+    help="Don't read requests from stdin (needs --socket).")
+    parser.add_argument("--cache-size", type=int, default=100000,
+    help="Number of distinct words to keep in the transliteration cache. Default is 100000")
+    parser.add_argument("--max-batch", type=int, default=1024,
+    help="Most requests to run in one batch. Default is 1024")
+    args = parser.parse_args()
+
+    # stop on SIGTERM (e.g. from a service manager) the way Ctrl-C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    batcher = MicroBatcher(make_ops(TranslationCache(args.cache_size)), args.max_batch)
+    server = None
+    if args.socket is not None:
+        server = serve_socket(args.socket, batcher)
+
+    try:
+        if args.no_stdio:
+            threading.Event().wait()
+        else:
+            reply = line_writer(sys.stdout)
+            for line in sys.stdin:
+                if line.strip():
+                    batcher.submit(line, reply)
+            if server is not None:
+                threading.Event().wait() # stdin closed, keep serving the socket
+    except KeyboardInterrupt:
+        pass
+    finally:
+        batcher.stop()
+        if server is not None:
+            server.shutdown()
+            os.remove(args.socket)
+        print(batcher.report(), file=sys.stderr)
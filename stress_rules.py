@@ -0,0 +1,224 @@
+'''
+Declarative stress rules, shared by the Arabic and Hindi scripts.
+
+A language gives a syllable weight function (syllable -> int, or None if
+the syllable can't be classified) and an ordered list of Rules; the first
+rule that applies to a word picks its stressed syllable. StressRules
+compiles them once and then works on integer weights only: match() for
+one word, match_flat() for a whole batch of words as one flat array of
+weights with the offset where each word starts (segmented NumPy
+reductions, one pass per rule; match() on each word if NumPy isn't
+installed).
+
+Example (add_stress_hi.py):
+hindi_rules = StressRules(syllable_weight, [
+    Rule('single heaviest syllable', heaviest=0, ties=1),
+    Rule('tie: rightmost non-final', heaviest=0, nonfinal=True),
+    Rule('tie: rightmost is final, next rightmost', heaviest=1),
+])
+weights, starts = hindi_rules.weigh(pform.split('.') for pform in pforms)
+indices, rule_ids = hindi_rules.match_flat(weights, starts)
+'''
+
+
+class Rule:
+    '''
+    One stress rule: which syllable it stresses, and when it applies.
+    * position: stress this syllable, counted from the start (0, 1, ...)
+      or from the end (-1 final, -2 penult, ...)
+    * heaviest: or stress a heaviest syllable, 0 the rightmost of those
+      tied, 1 the next rightmost, ...
+    * weights: the stressed syllable has one of these weights (default any)
+    * syllables: (min, max) number of syllables in the word (max None for
+      no limit)
+    * ties: at most this many syllables are tied for heaviest
+    * nonfinal: the stressed syllable isn't the final one
+    A rule doesn't apply if the word has no such syllable.
+    '''
+
+    def __init__(self, name, position=None, heaviest=None, weights=None,
+                 syllables=None, ties=None, nonfinal=False):
+        if (position is None) == (heaviest is None):
+            raise ValueError(f"rule '{name}' needs one of position or heaviest")
+        self.name = name
+        self.position = position
+        self.heaviest = heaviest
+        self.weights = None if weights is None else frozenset(weights)
+        self.syllables = syllables
+        self.ties = ties
+        self.nonfinal = nonfinal
+
+    def __repr__(self):
+        return f"Rule({self.name!r})"
+
+
+# fewer words than this are matched one at a time, without NumPy
+match_array_min_words = 1000
+
+
+class StressRules:
+    '''
+    Compiled stress rules of a language: weight(syllable) gives an int
+    weight (None if it can't be classified) and rules are tried in order.
+    Rules are referred to by their position in rules (rule id); names
+    gives their names. Words with a syllable that can't be classified
+    get no stress (index and rule id -1).
+    '''
+
+    def __init__(self, weight, rules):
+        self.weight = weight
+        self.rules = list(rules)
+        self.names = [rule.name for rule in self.rules]
+        # ranks of the heaviest syllables any rule looks at
+        self.heaviest_ranks = max((rule.heaviest + 1 for rule in self.rules
+                                   if rule.heaviest is not None), default=0)
+        self.uses_ties = any(rule.heaviest is not None or rule.ties is not None
+                             for rule in self.rules)
+        self.matchers = [self.compile(rule) for rule in self.rules]
+
+    @staticmethod
+    def compile(rule):
+        '''
+        Returns function: (weights, number of syllables, indices of the
+        heaviest syllables left to right) -> index of the syllable rule
+        stresses, or None if it doesn't apply.
+        '''
+        position, rank, weights = rule.position, rule.heaviest, rule.weights
+        min_syllables, max_syllables = rule.syllables or (1, None)
+        max_syllables = max_syllables or float('inf')
+        max_ties = rule.ties or float('inf')
+        nonfinal = rule.nonfinal
+
+        if rank is not None:
+            rank = -1 - rank # from the right
+            def matcher(word_weights, n, tied):
+                if len(tied) < -rank or len(tied) > max_ties:
+                    return None
+                ix = tied[rank]
+                if nonfinal and ix == n - 1:
+                    return None
+                if weights is not None and word_weights[ix] not in weights:
+                    return None
+                return ix if min_syllables <= n <= max_syllables else None
+        else:
+            def matcher(word_weights, n, tied):
+                ix = position if position >= 0 else n + position
+                if not 0 <= ix < n or not min_syllables <= n <= max_syllables:
+                    return None
+                if tied is not None and len(tied) > max_ties:
+                    return None
+                if weights is not None and word_weights[ix] not in weights:
+                    return None
+                if nonfinal and ix == n - 1:
+                    return None
+                return ix
+
+        return matcher
+
+    def weights(self, syllables):
+        '''
+        Returns list of the weights of syllables (0 if unclassified).
+        '''
+        return [self.weight(syl) or 0 for syl in syllables]
+
+    def weigh(self, words):
+        '''
+        Weigh the syllables of words (each an iterable of syllables).
+        Returns (flat list of weights, list of where each word starts).
+        '''
+        flat_syllables = []
+        starts = []
+        for syllables in words:
+            starts.append(len(flat_syllables))
+            flat_syllables.extend(syllables)
+        # each distinct syllable weighed once
+        weight = self.weight
+        known = {syl: weight(syl) or 0 for syl in dict.fromkeys(flat_syllables)}
+        return list(map(known.__getitem__, flat_syllables)), starts
+
+    def match(self, weights):
+        '''
+        Returns (index of the stressed syllable, rule id) of a word with
+        these syllable weights, or (-1, -1).
+        '''
+        if not weights or 0 in weights:
+            return -1, -1
+        n = len(weights)
+        tied = None
+        if self.uses_ties:
+            heaviest = max(weights)
+            tied = [ix for ix, weight in enumerate(weights) if weight == heaviest]
+        for rule_id, matcher in enumerate(self.matchers):
+            ix = matcher(weights, n, tied)
+            if ix is not None:
+                return ix, rule_id
+        return -1, -1
+
+    def match_flat(self, weights, starts):
+        '''
+        Same as match() for a batch of words, given as weigh() returns
+        them (every word has at least one syllable). Under
+        match_array_min_words words, or without NumPy, match() runs on
+        each.
+        Returns (list of stressed syllable indices, list of rule ids).
+        '''
+        np = None
+        if len(starts) >= match_array_min_words:
+            try:
+                import numpy as np
+            except ImportError:
+                pass
+        if np is None:
+            ends = starts[1:] + [len(weights)]
+            matches = [self.match(weights[start:end]) for start, end in zip(starts, ends)]
+            return [ix for ix, _ in matches], [rule_id for _, rule_id in matches]
+
+        weights = np.asarray(weights)
+        starts = np.asarray(starts)
+        ends = np.append(starts[1:], len(weights)) # one past the final syllable
+        lengths = ends - starts
+        rows = np.repeat(np.arange(len(starts)), lengths)
+        positions = np.arange(len(weights))
+
+        if self.uses_ties:
+            # heaviest syllables of each word, rightmost first
+            heaviest = np.maximum.reduceat(weights, starts)
+            is_tied = weights == heaviest[rows]
+            ties = np.add.reduceat(is_tied, starts)
+            tied = []
+            for rank in range(self.heaviest_ranks):
+                tied.append(np.maximum.reduceat(np.where(is_tied, positions, -1), starts))
+                is_tied = is_tied & (positions != tied[-1][rows])
+
+        stressed = np.full(len(starts), -1)
+        rule_ids = np.full(len(starts), -1)
+        # words with a syllable that can't be classified get no stress
+        open_words = np.minimum.reduceat(weights, starts) > 0
+        for rule_id, rule in enumerate(self.rules):
+            if rule.heaviest is not None:
+                ix = tied[rule.heaviest]
+                applies = ix >= 0
+            elif rule.position >= 0:
+                ix = starts + rule.position
+                applies = rule.position < lengths
+            else:
+                ix = ends + rule.position
+                applies = -rule.position <= lengths
+            if rule.syllables is not None:
+                min_syllables, max_syllables = rule.syllables
+                applies &= lengths >= min_syllables
+                if max_syllables is not None:
+                    applies &= lengths <= max_syllables
+            if rule.ties is not None:
+                applies &= ties <= rule.ties
+            if rule.weights is not None:
+                ix_weights = weights[np.clip(ix, 0, len(weights) - 1)]
+                applies &= np.isin(ix_weights, list(rule.weights))
+            if rule.nonfinal:
+                applies &= ix != ends - 1
+            applies &= open_words
+            stressed[applies] = (ix - starts)[applies]
+            rule_ids[applies] = rule_id
+            open_words &= ~applies
+
+        return stressed.tolist(), rule_ids.tolist()
@@ -11,17 +11,33 @@ Script developed on Buckwalter MADAMIRA output of Common Voice Arabic corpus.
 
 -------------------------------------------------------------------------------
 
-You may need to pip install pandas.
+You may need to pip install pandas (only used to read big .csv/.tsv files).
 
 Usage:
 python transliterate.py input_file
 python transliterate.py input_file --outpath my_path/my_filename.csv
+python transliterate.py input_file --chunksize 100000
+python transliterate.py input_file --stats stats.json
+python transliterate.py input_file.parquet --outpath output.csv.gz --project
+python transliterate.py input_file --outpath output.csv --incremental output.csv
+python transliterate.py input_file --low-memory --max-memory 2G
 '''
 
 import argparse
-import pandas as pd
+import hashlib
+import json
+import os
+import phone_inventory
+import re
 import sys
 from ast import literal_eval
+from cli_utils import (Incremental, RunStats, ShardPool, add_table_options, as_list,
+                       compact_column, map_distinct, process_table, rules_version,
+                       table_settings)
+from collections import OrderedDict
+from functools import partial
+from phone_inventory import (arabic_consonants, arabic_coronals,
+                             arabic_vowel_initial, pharyngeal)
 
 # 1:1 correspondences
 char_dict = {
@@ -81,11 +97,13 @@ special_char_dict = {
 'y' : ['j',':'],   #long vowel in the environment i_C, elsewhere: j
 }
 
-# useful lists for transcription
-vowel_initial = ['a','a:','i','i:','u','u:','e','e:','an','in','un']
-coronals = ['d','dˁ','n','r','s','sˁ','t','tˁ','θ','z','ðˁ','ð','ʃ','l']
-consonants = ['b','x','d','dˁ','ʕ','f','ɣ','h','ħ','ʒ','k','l','m','n',
-            'q','r','s','sˁ','t','tˁ','θ','v','z','ðˁ','ð','ʃ','ʔ','ˁ']
+# useful sets for transcription (see phone_inventory.py)
+vowel_initial = arabic_vowel_initial
+coronals = arabic_coronals
+consonants = arabic_consonants | {pharyngeal} # diacritic checked as a consonant
+
+# RunStats while --stats is on (see cli_utils.py)
+stats = None
 
 
 ############################## HELPER FUNCTIONS ###############################
@@ -104,11 +122,17 @@ def liaison(pseudo_ipa):
             # realization of word-final 'p' depends on onset of following word
             # 'T' used as placeholder
                 ipa += special_char_dict[char][0]
+                if stats is not None:
+                    stats.count('p word-final')
             else:
                 if pseudo_ipa[i+1] in vowel_initial:
                     ipa += special_char_dict[char][1]
+                    if stats is not None:
+                        stats.count('p before vowel')
                 else:
                     ipa += special_char_dict[char][2]
+                    if stats is not None:
+                        stats.count('p deleted')
         else:
             ipa += char
 
@@ -123,6 +147,8 @@ def sun_letters(pseudo_ipa):
     '''
     if pseudo_ipa[:3] == 'ʔal':
         if pseudo_ipa[3] in coronals:
+            if stats is not None:
+                stats.count('sun letter article')
             # if there is already a geminate Sun letter, delete the /l/
             if pseudo_ipa[3] == pseudo_ipa[4]:
                 ipa = pseudo_ipa[:2] + pseudo_ipa[3:]
@@ -162,6 +188,8 @@ def sun_letters(pseudo_ipa):
         # remove erroneous /l/s
         if '%' in phones:
             phones.remove('%')
+            if stats is not None:
+                stats.count('CCC /l/ removed')
         ipa = ''.join(phones)
 
     return ipa
@@ -220,19 +248,29 @@ def translate(bw):
         # 'ʔa' word-initial, delete before 'an' morpheme, 'a:' elsewhere
             if i == 0:
                 second_pass += special_char_dict[char][0]
+                if stats is not None:
+                    stats.count('A word-initial')
             elif first_pass[i-1] == 'i':
                 second_pass += special_char_dict[char][2]
+                if stats is not None:
+                    stats.count('A after i')
             elif first_pass[i-1] == 'a':
                 second_pass += ':'
+                if stats is not None:
+                    stats.count('A after a')
             elif len(first_pass) >= 3:
                 if first_pass[i+1:] == 'an':
                     second_pass += ''
+                    if stats is not None:
+                        stats.count('A before final an')
                 else:
                     second_pass += special_char_dict[char][1]
             else:
                 second_pass += special_char_dict[char][1]
         elif char == '~':
         # geminate previous consonant
+            if stats is not None:
+                stats.count('geminate')
             if second_pass[-1] == 'ˁ':
                 second_pass += second_pass[-2:]
             else:
@@ -242,16 +280,22 @@ def translate(bw):
             if 'ww' in first_pass:
             # there is an issue with Buckwalter transcription
                 second_pass = '' 
+                if stats is not None:
+                    stats.count('ww (empty IPA)')
                 break
             elif (second_pass == '') or (second_pass[-1] != 'u'):
                 second_pass += special_char_dict[char][0]
             else:
                 if i == len(first_pass)-1: #word-final
                     second_pass += special_char_dict[char][1]
+                    if stats is not None:
+                        stats.count('w after u (long vowel)')
                 elif (first_pass[i+1] == '~') or (first_pass[i+1] in vowel_initial): #geminate or before vowel
                         second_pass += special_char_dict[char][0]
                 else: #before consonant
                     second_pass += special_char_dict[char][1]
+                    if stats is not None:
+                        stats.count('w after u (long vowel)')
         elif char == 'y':
         # long vowel in the environment 'i_C' and word-final, elsewhere: 'j'
             if (second_pass == '') or (second_pass[-1] != 'i'):
@@ -259,12 +303,16 @@ def translate(bw):
             else:
                 if i == len(first_pass)-1: #word-final
                     second_pass += special_char_dict[char][1]
+                    if stats is not None:
+                        stats.count('y after i (long vowel)')
                 elif first_pass[i+1] == '~': #geminate
                     second_pass += special_char_dict[char][0]
                 elif (first_pass[i+1] == 'A') or (first_pass[i+1] in vowel_initial): #before vowel
                     second_pass += special_char_dict[char][0]
                 else: #before consonant
                     second_pass += special_char_dict[char][1]
+                    if stats is not None:
+                        stats.count('y after i (long vowel)')
         else:
             second_pass += char
 
@@ -276,32 +324,414 @@ def translate(bw):
 
     ## FINAL PASS: Glide nuclei
     ipa = vocalize(fourth_pass,ignore=False)
+    if stats is not None:
+        # counted here, since translate_batch() counts the words it
+        # hands to vocalize() itself
+        if glide_nucleus_re.search(fourth_pass):
+            stats.count('glide nucleus vocalized')
+        if final_T_re.search(fourth_pass + '\n'):
+            stats.count('final T after consonant')
+
+    return ipa
+
+
+############################## COMPILED ENGINE ################################
+# Tables and patterns built once from the rule tables above. They apply the
+# same rules as translate() to a whole column at once: words are joined one per
+# line, the 1:1 pass is a single str.translate(), and every later rule is a
+# substitution with a few characters of context that never crosses a newline.
+
+def char_class(chars):
+    '''
+    Return a regex character class matching any of the single characters
+    in chars (multi-character phones are skipped).
+    '''
+    return '[' + re.escape(''.join(sorted(c for c in chars if len(c) == 1))) + ']'
+
+
+# Buckwalter is ASCII, so the 1:1 table is a plain list indexed by code point
+first_pass_table = [chr(i) for i in range(128)]
+for char in char_dict:
+    first_pass_table[ord(char)] = char_dict[char]
+known_chars = (''.join(char_dict) + ''.join(special_char_dict) + '\n').encode()
+vowel_class = char_class(vowel_initial)
+consonant_class = char_class(consonants)
+plain_consonant_class = char_class(set(consonants) - {'ˁ'}) # no diacritic
+sun_class = char_class(coronals)
+
+# words the patterns don't cover (unknown characters, geminated geminates and
+# glides, words too short for sun_letters()) go through translate() instead
+unknown_re = re.compile('[^' + re.escape(known_chars.decode()) + ']')
+irregular_re = re.compile('~(?:(?<=\n~)|[~wy])')
+short_article_re = re.compile('\nʔal' + sun_class + '?\n')
+# SECOND PASS: 1:many correspondences
+ww_re = re.compile('\n[^\n]*ww[^\n]*(?=\n)')
+long_w_re = re.compile('w(?<=uw)(?!~|' + vowel_class + ')')
+long_y_re = re.compile('y(?<=iy)(?![~A]|' + vowel_class + ')')
+# THIRD PASS: Buckwalter 'p' character
+p_before_vowel_re = re.compile('p(?=' + vowel_class + ')')
+# FOURTH PASS: Sun letters
+article_re = re.compile('\nʔal(' + sun_class + ')(\\1|ˁ)?')
+ccc_l_re = re.compile('l(?=' + plain_consonant_class + 'ˁ?'
+                      + plain_consonant_class + ')')
+first_removed_re = re.compile('\n([^%\n]*)%')
+# FINAL PASS: Glide nuclei
+glide_nucleus_re = re.compile('[jw](?<=' + consonant_class + '[jw])'
+                              + consonant_class)
+final_T_re = re.compile('T(?<=' + consonant_class + 'T)(?=\n)')
+
+
+def matching_lines(pattern, text):
+    '''
+    Return the set of word numbers that pattern matches in text,
+    where text has a newline before and after every word.
+    '''
+    lines = set()
+    newlines = 0
+    pos = 0
+    for match in pattern.finditer(text):
+        newlines += text.count('\n', pos, match.start() + 1)
+        pos = match.start() + 1
+        lines.add(newlines - 1)
+
+    return lines
+
+
+def geminate(pseudo_ipa):
+    '''
+    Replace every '~' with a copy of the phone before it.
+    Returns updated form.
+    '''
+    parts = pseudo_ipa.split('~')
+    ipa = [parts[0]]
+    for prev, part in zip(parts, parts[1:]):
+        if prev[-1:] == 'ˁ':
+            copy = prev[-2:]
+        else:
+            copy = prev[-1:]
+        # never copy a word boundary; those words go through translate()
+        ipa.append(copy.replace('\n', ''))
+        ipa.append(part)
+
+    return ''.join(ipa)
+
+
+def sun_article(match):
+    '''
+    Assimilate the /l/ of a matched /ʔal-/ to the Sun letter after it,
+    or delete it if the Sun letter is already geminate.
+    '''
+    if match.group(2) is None:
+        return '\nʔa' + match.group(1) * 2
+    return '\nʔa' + match.group(1) + match.group(2)
+
+
+def translate_batch(words):
+    '''
+    Compiled version of translate() for a list of Buckwalter words.
+    Returns the list of IPA strings, identical to calling translate() on
+    each word.
+    '''
+    if len(words) == 0:
+        return []
+    try:
+        text = '\n' + '\n'.join(words) + '\n'
+    except TypeError:
+        return [translate(bw) for bw in words] # fails like translate()
+    if text.count('\n') != len(words) + 1:
+        return [translate(bw) for bw in words]
+
+    if stats is not None:
+        stats.start()
+
+    ## FIRST PASS: replace all 1:1 Buckwalter:IPA correspondences
+    first_pass = text.translate(first_pass_table)
+    if text.isascii() and not text.encode().translate(None, known_chars):
+        reference = set()
+    else:
+        reference = matching_lines(unknown_re, text)
+    if '~' in first_pass:
+        reference |= matching_lines(irregular_re, first_pass)
+    if reference:
+        # blank the words translate() will redo, so the rules (and their
+        # counters) below only see the others
+        lines = first_pass.split('\n')
+        for i in reference:
+            lines[i + 1] = ''
+        first_pass = '\n'.join(lines)
+    if stats is not None:
+        stats.lap('translate_batch: first pass')
+
+    ## SECOND PASS: 1:many correspondences
+    ipa = first_pass
+    if 'ww' in ipa:
+        # there is an issue with Buckwalter transcription
+        ipa, n = ww_re.subn('\n', ipa)
+        if stats is not None:
+            stats.count('ww (empty IPA)', n)
+    if 'w' in ipa:
+        ipa, n = long_w_re.subn(special_char_dict['w'][1], ipa)
+        if stats is not None:
+            stats.count('w after u (long vowel)', n)
+    if 'y' in ipa:
+        ipa, n = long_y_re.subn(special_char_dict['y'][1], ipa)
+        if stats is not None:
+            stats.count('y after i (long vowel)', n)
+        ipa = ipa.replace('y', special_char_dict['y'][0])
+    if 'A' in ipa:
+        if stats is not None:
+            stats.count('A after a', ipa.count('aA'))
+            stats.count('A after i', ipa.count('iA'))
+            stats.count('A word-initial', ipa.count('\nA'))
+            stats.count('A before final an', ipa.count('Aan\n'))
+        ipa = ipa.replace('aA', 'a:')
+        ipa = ipa.replace('iA', 'i' + special_char_dict['A'][2])
+        ipa = ipa.replace('\nA', '\n' + special_char_dict['A'][0])
+        ipa = ipa.replace('Aan\n', 'an\n')
+        ipa = ipa.replace('A', special_char_dict['A'][1])
+    if '~' in ipa:
+        if stats is not None:
+            stats.count('geminate', ipa.count('~'))
+        ipa = geminate(ipa)
+    if stats is not None:
+        stats.lap('translate_batch: second pass')
+
+    ## THIRD PASS: Buckwalter 'p' character
+    if 'p' in ipa:
+        ipa, n = p_before_vowel_re.subn(special_char_dict['p'][1], ipa)
+        if stats is not None:
+            stats.count('p before vowel', n)
+            stats.count('p word-final', ipa.count('p\n'))
+            stats.count('p deleted', ipa.count('p') - ipa.count('p\n'))
+        ipa = ipa.replace('p\n', special_char_dict['p'][0] + '\n')
+        ipa = ipa.replace('p', special_char_dict['p'][2])
+    if stats is not None:
+        stats.lap('translate_batch: liaison')
+
+    ## FOURTH PASS: Sun letters
+    if '\nʔal' in ipa:
+        reference |= matching_lines(short_article_re, ipa)
+        ipa, n = article_re.subn(sun_article, ipa)
+        if stats is not None:
+            stats.count('sun letter article', n)
+    if 'l' in ipa:
+        ipa = ccc_l_re.sub('%', ipa)
+        if '%' in ipa:
+            # sun_letters() removes the first erroneous /l/ and leaves '%'
+            ipa, n = first_removed_re.subn('\n\\1', ipa)
+            if stats is not None:
+                stats.count('CCC /l/ removed', n)
+    if stats is not None:
+        stats.lap('translate_batch: sun_letters')
+
+    ## FINAL PASS: Glide nuclei
+    glide_lines = matching_lines(glide_nucleus_re, ipa) - reference
+    if glide_lines:
+        before_T = ipa.split('\n')[1:-1]
+    ipa, n = final_T_re.subn('aT', ipa)
+    if stats is not None:
+        stats.count('glide nucleus vocalized', len(glide_lines))
+        stats.count('final T after consonant', n)
+
+    ipa = ipa.split('\n')[1:-1]
+    for i in glide_lines:
+        ipa[i] = vocalize(before_T[i],ignore=False)
+    if stats is not None:
+        stats.lap('translate_batch: vocalize')
+        stats.count('fallback to translate()', len(reference))
+    for i in reference:
+        ipa[i] = translate(words[i])
 
     return ipa
 
 
+def translate_fast(bw):
+    '''
+    Compiled version of translate() for a single word. Returns IPA string.
+    '''
+    return translate_batch([bw])[0]
+
+
+def compare_engines(words):
+    '''
+    Run translate() and translate_batch() over words.
+    Returns a list of (bw, reference, fast) for every word they disagree on.
+    '''
+    mismatches = []
+    for bw, fast in zip(words, translate_batch(words)):
+        reference = translate(bw)
+        if reference != fast:
+            mismatches.append((bw, reference, fast))
+
+    return mismatches
+
+
+################################# MEMO CACHE ##################################
+
+def rules_hash():
+    '''
+    Return a short hash of the rule tables. Cached transcriptions are only
+    reused while it matches, so editing the tables invalidates them.
+    '''
+    tables = [char_dict, special_char_dict,
+              sorted(vowel_initial), sorted(coronals), sorted(consonants)]
+    dump = json.dumps(tables, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(dump.encode()).hexdigest()[:16]
+
+
+class TranslationCache:
+    '''
+    Bounded LRU memo of Buckwalter -> IPA transcriptions, optionally saved
+    to a JSON file so later runs over the same or overlapping corpora can
+    skip the words they have already seen.
+    '''
+
+    def __init__(self, maxsize=100000, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        if path is not None and os.path.exists(path):
+            with open(path, encoding='utf-8') as cache_file:
+                saved = json.load(cache_file)
+            # stale if the rule tables changed since it was written
+            if saved.get('rules') == rules_hash():
+                self.entries.update(saved['ipa'])
+                self.evict()
+
+    def translate(self, words, pool=None):
+        '''
+        Look up the IPA of every word, transcribing the ones not in the
+        cache with translate_batch(), sharded over pool if given.
+        Returns list of IPA strings.
+        '''
+        entries = self.entries
+        missing = [bw for bw in dict.fromkeys(words) if bw not in entries]
+        if pool is None:
+            entries.update(zip(missing, translate_batch(missing)))
+        else:
+            entries.update(zip(missing, pool.map(translate_batch, missing)))
+        self.misses += len(missing)
+        self.hits += len(words) - len(missing)
+
+        ipa = []
+        for bw in words:
+            entries.move_to_end(bw)
+            ipa.append(entries[bw])
+        self.evict()
+
+        return ipa
+
+    def evict(self):
+        '''
+        Drop least recently used entries until the cache fits maxsize.
+        '''
+        if self.maxsize is not None:
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def save(self):
+        '''
+        Write the cache to its file, if it has one.
+        '''
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'rules': rules_hash(), 'ipa': self.entries},
+                      cache_file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def report(self):
+        '''
+        Return hit/miss counts as a printable string.
+        '''
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (f"Cache: {self.hits} hits, {self.misses} misses "
+                f"({rate:.1%} hit rate), {len(self.entries)} entries")
+
+
+def add_ipa(df, pool, cache=None, incremental=None, low_memory=False):
+    '''
+    Add column "IPA" with the transcription of column "Buckwalter",
+    running the work over the ShardPool pool.
+    Uses the cache (compiled engine) if given, else translate() word by word.
+    With incremental (see cli_utils.py), only rows not in the previous
+    run are transcribed. With low_memory, "IPA" is categorical.
+    Returns updated df.
+    '''
+    bw_col = df["Buckwalter"] #column name with Buckwalter token
+    if cache is None:
+        batch_func = partial(pool.map_each, translate)
+    else:
+        batch_func = partial(cache.translate, pool=pool)
+    # transcribe each distinct word once
+    transcribe = partial(map_distinct, batch_func)
+    if incremental is None:
+        ipa_col = transcribe(bw_col, categorical=low_memory)
+    else:
+        ipa_col = incremental.map(transcribe, "IPA", as_list(bw_col))
+        if low_memory:
+            ipa_col = compact_column(ipa_col)
+
+    df["IPA"] = ipa_col
+    return df
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("input_file",  
-    help="Give path of the directory with Buckwalter data. Must be .csv. Name of column with Buckwalter assumed to be 'Buckwalter'.")
+    help="Give path of the directory with Buckwalter data. Must be .csv/.tsv (optionally compressed, e.g. .csv.gz), .parquet or .arrow. Name of column with Buckwalter assumed to be 'Buckwalter'.")
     parser.add_argument("--outpath", default="./output.csv",
-    help="Give output filename and path. Default is ./output.csv")
+    help="Give output filename and path; the extension gives the format, as for input_file. Default is ./output.csv")
+    parser.add_argument("--reference", action="store_true",
+    help="Use the reference translate() word by word instead of the compiled engine.")
+    parser.add_argument("--cache-size", type=int, default=100000,
+    help="Number of distinct words to keep in the in-memory cache. Default is 100000")
+    parser.add_argument("--cache-file", default=None,
+    help="Give path of a .json file to keep transcriptions between runs. Optional.")
+    parser.add_argument("--workers", type=int, default=1,
+    help="Number of worker processes. Default is 1")
+    parser.add_argument("--project", action="store_true",
+    help="Only read column 'Buckwalter' of input_file (the other columns are left out of the output).")
+    parser.add_argument("--stats", default=None,
+    help="Give path of a .json file for per-stage timings and rule counts over distinct values (work done outside --workers only). Optional.")
+    add_table_options(parser)
     args = parser.parse_args()
 
-    # read in data from file as pandas df
-    df = pd.read_csv(args.input_file)
-    
-    # iterate over data to add new column with IPA representation(s)
-    ipa_col = []
-    for index, row in df.iterrows():
-        bw = row["Buckwalter"] #column name with Buckwalter token
-
-        # get IPA transcription of Buckwalter
-        ipa = translate(bw)
-        ipa_col.append(ipa)
+    if args.stats is not None:
+        RunStats().instrument(sys.modules[__name__],
+            ['translate', 'translate_batch', 'liaison', 'sun_letters', 'vocalize'])
 
-    # update dataframe and write to new file
-    df["IPA"] = ipa_col
+    incremental = None
+    if args.incremental is not None:
+        incremental = Incremental(rules_version(__file__, phone_inventory.__file__),
+                                  {"IPA": "Buckwalter"}, args.incremental)
 
-    df.to_csv(path_or_buf=args.outpath, index=False)
\ No newline at end of file
+    if args.reference:
+        cache = None
+    else:
+        # transcribe with the compiled engine, reusing transcriptions
+        # of words seen before
+        cache = TranslationCache(args.cache_size, args.cache_file)
+
+    columns = ["Buckwalter"] if args.project else None
+    dtype, chunksize = table_settings(args)
+
+    with ShardPool(args.workers) as pool:
+        process_table(args.input_file, args.outpath,
+                      partial(add_ipa, pool=pool, cache=cache, incremental=incremental,
+                              low_memory=args.low_memory),
+                      chunksize, columns=columns, dtype=dtype)
+
+    if incremental is not None:
+        incremental.save(args.outpath)
+        print(incremental.report())
+    if cache is not None:
+        cache.save()
+        print(cache.report())
+    if stats is not None:
+        stats.dump(args.stats)
\ No newline at end of file